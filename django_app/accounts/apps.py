@@ -3,4 +3,10 @@ from django.utils.translation import gettext_lazy as _
 
 class AccountsConfig(AppConfig):
     name = "django_synergy.accounts"
-    verbose_name = _("Accounts")
\ No newline at end of file
+    verbose_name = _("Accounts")
+
+    def ready(self):
+        try:
+            import django_synergy.accounts.signals  # noqa F401
+        except ImportError:
+            pass
@@ -0,0 +1,576 @@
+import csv
+import datetime
+from collections import defaultdict
+from io import TextIOWrapper
+from re import compile, sub
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+from openpyxl import load_workbook
+from rest_framework.exceptions import ParseError
+
+from django_synergy.utils.mappings import abbrev_us_state, abbrev_country
+
+from .models import Account, AccountHierarchy, AccountUploadItems, UserSubscription, slugify
+from .slugs import allocate_slugs, assign_slugs
+from .utils import AccountDropdown
+
+ACCOUNT_IMPORT_DICTIONARY = {
+    "account_number": "account_number",
+    "account_name": "account_name",
+    "city": "city",
+    "state": "state",
+    "country": "country",
+    "zipcode": "zipcode",
+    "phone1": "phone1",
+    "phone2": "phone2",
+    "address1": "address1",
+    "address2": "address2",
+    "address3": "address3",
+    "domain": "domain",
+    "hq_account_number": "hq_account_number",
+    "no_of_usr_subs": "no_of_usr_subs",
+    "sub_start_date": "sub_end_date",
+    "sub_end_date": "sub_end_date",
+    "language": "language"
+}
+
+ACCOUNT_UPLOAD_ITEM_FIELDS = (
+    "account_number", "hq_account_number", "account_name", "account_type", "city", "state", "country", "zipcode",
+    "phone1", "phone1_ext", "phone2", "phone2_ext", "address1", "address2", "address3", "domain",
+    "sub_start_date", "sub_end_date", "no_of_usr_subs", "language",
+)
+
+LANGUAGE_CODES = {"English": "en", "Spanish": "es", "French": "fr"}
+
+ACCOUNT_TYPE_CODES = {"Head Quarter": "hq", "Subsidiary": "sub", "Head Quarter / Subsidiary": "hq_sub"}
+
+ACCOUNT_BULK_FIELDS = (
+    "account_id", "account_name", "account_type", "city", "state", "country", "zipcode", "phone1", "phone2",
+    "address1", "address2", "address3", "domain", "language", "is_active",
+)
+
+PHONE_REGEX = compile(
+    '(?P<country>[0-9]{0,3})\s{0,1}\((?P<city>[0-9]{3})\)\s{1}(?P<first>[0-9]{3})[-]{1}(?P<second>[0-9]{4})\s{0,1}[x]{0,1}\s{0,1}(?P<ext>[0-9]{0,6})')
+DOMAIN_REGEX = compile('(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z0-9][a-z0-9-]{0,61}[a-z0-9]')
+CONSTRAINT_KEY = compile(r'Key \((\w+)\)=\((.*?)\)')
+
+
+def try_parsing_date(text):
+    for fmt in ('%m/%d/%Y', '%d-%b-%y', '%m-%d-%Y'):
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError('no valid date format found')
+
+
+def xlsx_cell_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, float) and int(value) == value:
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def read_rows(file, filename, fieldnames):
+    """
+    Yields the rows of an uploaded csv or xlsx file one at a time as dicts keyed by column name.
+    """
+    ext = filename.split('.')[-1]
+    if ext == 'csv':
+        reader = csv.DictReader(TextIOWrapper(file, encoding='utf-8'), fieldnames=fieldnames, delimiter=',')
+        next(reader)
+        for row in reader:
+            yield row
+
+    elif ext == 'xlsx':
+        book = load_workbook(file, read_only=True, data_only=True)
+        rows = book.worksheets[0].iter_rows(values_only=True)
+        keys = next(rows)
+        for values in rows:
+            yield {key: xlsx_cell_value(value) for key, value in zip(keys, values)}
+        book.close()
+
+
+def count_rows(file, filename):
+    """
+    Returns the number of data rows of an uploaded xlsx file from its dimensions, leaving it
+    rewound. A csv file would have to be read twice to count its rows, its total stays unknown
+    until the import completes.
+    """
+    ext = filename.split('.')[-1]
+    total_rows = None
+    if ext == 'xlsx':
+        book = load_workbook(file, read_only=True)
+        max_row = book.worksheets[0].max_row
+        total_rows = max_row - 1 if max_row else None
+        book.close()
+    file.seek(0)
+    return total_rows
+
+
+def has_errors(errors):
+    return bool(errors['error_detail']) or len(errors) > 1
+
+
+class AccountImporter(object):
+    """
+    Validates an account upload in a single pass over the file and stores the rows as
+    AccountUploadItems. Rows are read and written in chunks, the accounts referenced by a chunk
+    are looked up with one query and in-file checks use sets, so memory does not grow with the
+    file apart from rows waiting for an HQ that appears later in the file. Progress is recorded
+    on the upload after every chunk.
+    """
+    chunk_size = 1000
+
+    def __init__(self, account_upload):
+        self.account_upload = account_upload
+        self.account_upload_id = account_upload.id
+        self.processed_rows = 0
+        self.error_rows = 0
+        self.file_account_numbers = set()
+        self.waiting_for_hq = defaultdict(list)
+        self.row = None
+        self.current_column = None
+
+    def run(self, file, filename):
+        try:
+            chunk = []
+            for row in read_rows(file, filename, list(ACCOUNT_IMPORT_DICTIONARY.keys())):
+                chunk.append(row)
+                if len(chunk) == self.chunk_size:
+                    self.process_chunk(chunk)
+                    chunk = []
+            self.process_chunk(chunk)
+            self.finish()
+            self.account_upload.report_progress(self.processed_rows, self.error_rows)
+
+        except KeyError as key_error:
+            self.discard()
+            raise ParseError(
+                detail="Error in row with account number " + self.row_account_number() + ", unable to parse " + str(
+                    key_error))
+        except Exception:
+            self.discard()
+            raise ParseError(
+                detail="Error in row with account number " + self.row_account_number() + ", unable to parse key " + str(
+                    self.current_column))
+
+    def process_chunk(self, rows):
+        if not rows:
+            return
+        numbers = set(row.get('account_number') for row in rows) | set(row.get('hq_account_number') for row in rows)
+        numbers.discard(None)
+        numbers.discard('')
+        existing_accounts = dict(Account.objects.filter(account_id__in=numbers).annotate(
+            has_subsidiaries=Exists(Account.objects.filter(parent_account=OuterRef('pk')))).values_list(
+            'account_id', 'has_subsidiaries'))
+
+        items = []
+        for row in rows:
+            self.row = row
+            waiting_for_hq = self.parse_data(row, existing_accounts)
+            item = self.build_item(row)
+            if waiting_for_hq:
+                self.waiting_for_hq[row['hq_account_number']].append(item)
+            else:
+                items.append(item)
+            items += self.waiting_for_hq.pop(row['account_number'], [])
+
+        self.save_items(items)
+        self.processed_rows += len(rows)
+        self.account_upload.report_progress(self.processed_rows, self.error_rows)
+
+    def save_items(self, items):
+        AccountUploadItems.objects.bulk_create(items, batch_size=self.chunk_size)
+        self.error_rows += sum(1 for item in items if has_errors(item.errors))
+
+    def finish(self):
+        items = []
+        for waiting_items in self.waiting_for_hq.values():
+            for item in waiting_items:
+                item.errors["hq_account_does_not_exist"] = True
+                item.errors['error_detail'].append("Headquarter account does not exist in database or file")
+                items.append(item)
+        self.waiting_for_hq.clear()
+        self.save_items(items)
+
+        # subsidiaries that are the HQ of another row in the file
+        upload_items = AccountUploadItems.objects.filter(account_upload_id=self.account_upload_id)
+        upload_items.filter(
+            account_type='Subsidiary', account_number__in=upload_items.values('hq_account_number')).update(
+            account_type='Head Quarter / Subsidiary')
+
+    def discard(self):
+        AccountUploadItems.objects.filter(account_upload_id=self.account_upload_id).delete()
+
+    def row_account_number(self):
+        return str(self.row["account_number"]) if self.row else ''
+
+    def build_item(self, row):
+        item = AccountUploadItems(account_upload_id=self.account_upload_id, errors=row["errors"])
+        for field_name in ACCOUNT_UPLOAD_ITEM_FIELDS:
+            value = row.get(field_name)
+            field = AccountUploadItems._meta.get_field(field_name)
+            if field.get_internal_type() == 'CharField' and isinstance(value, str) and len(value) > field.max_length:
+                value = value[:field.max_length]
+                item.errors['value_too_long'] = True
+                item.errors['error_detail'].append(
+                    "{0} cannot be longer than {1} characters".format(field_name, field.max_length))
+            elif field.get_internal_type() == 'DateField' and not isinstance(value, datetime.date):
+                if value not in (None, ''):
+                    item.errors['data_missing'] = True
+                    item.errors['error_detail'].append("Unable to parse {0}".format(field_name))
+                value = None
+            setattr(item, field_name, value)
+        return item
+
+    def parse_data(self, row, existing_accounts):
+        """
+        Validates one row in place and returns True when its HQ has not been seen yet.
+        """
+        row_errors = {'error_detail': list()}
+        waiting_for_hq = False
+
+        self.current_column = "account_number"
+        if row['account_number'] is None or row['account_number'] == '':
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("Account number missing")
+        else:
+            if row['account_number'] in existing_accounts:
+                row_errors['account_already_exists'] = True
+                row_errors['error_detail'].append("Account with this account number already exists")
+            if row['account_number'] in self.file_account_numbers:
+                row_errors['dublicate_entry'] = True
+                row_errors['error_detail'].append("Duplicate entry")
+            else:
+                self.file_account_numbers.add(row['account_number'])
+
+            if len(row["account_number"]) > 12:
+                row_errors['error_detail'].append("Account Number cannot be more than 12 characters")
+
+        self.current_column = "account_name"
+        if row['account_name'] is None or row['account_name'] == '':
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("Account name missing")
+        else:
+            if len(row['account_name']) > 255:
+                row_errors['error_detail'].append("Account name length greater than 255")
+
+        self.current_column = "country"
+        if row['country'] is not None and row['country'] != '':
+            row['country'] = abbrev_country[row['country']].title()
+
+        self.current_column = "state"
+        if row['state'] is not None and row['state'] != '':
+            if row['country'] == 'United States':
+                try:
+                    row['state'] = abbrev_us_state[row['state']]
+                except Exception as e:
+                    row_errors['data_missing'] = True
+                    row_errors['error_detail'].append("Unable to parse state data")
+
+        self.current_column = "phone1"
+        self.parse_phone(row, row_errors, 'phone1', "Phone1")
+
+        self.current_column = "phone2"
+        self.parse_phone(row, row_errors, 'phone2', "Phone2")
+
+        self.current_column = "domain"
+        if row['domain'] is not None and row['domain'] != '':
+            if not DOMAIN_REGEX.match(row['domain']):
+                row_errors['domain_error'] = True
+                row_errors['error_detail'].append("Unable to parse domain, might not be valid")
+
+        self.current_column = "hq_account_number"
+        if row['hq_account_number'] is None or row['hq_account_number'] == '':
+            row['account_type'] = 'Head Quarter'
+        else:
+            # subsidiaries that are the HQ of a later row are promoted in finish()
+            if existing_accounts.get(row['account_number']):
+                row['account_type'] = 'Head Quarter / Subsidiary'
+            else:
+                row['account_type'] = 'Subsidiary'
+            if row['hq_account_number'] not in existing_accounts and \
+                row['hq_account_number'] not in self.file_account_numbers:
+                waiting_for_hq = True
+
+        self.current_column = "no_of_usr_subs"
+        if row['no_of_usr_subs'] is None or row['no_of_usr_subs'] == '':
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("User subscription missing, enter 0 if there are none")
+            row['no_of_usr_subs'] = None
+        else:
+            try:
+                row['no_of_usr_subs'] = int(sub(r'\.0*\s*$', '', str(row['no_of_usr_subs'])))
+            except ValueError:
+                row_errors['data_missing'] = True
+                row_errors['error_detail'].append("Unable to parse user subscription")
+                row['no_of_usr_subs'] = None
+
+        self.current_column = "sub_start_date"
+        if row['sub_start_date'] is None or row['sub_start_date'] == '':
+            row['sub_start_date'] = None
+        else:
+            if not type(row['sub_start_date']) == datetime.date:
+                try:
+                    row['sub_start_date'] = try_parsing_date(row['sub_start_date']).date()
+                except Exception:
+                    row_errors["data_missing"] = True
+                    row_errors['error_detail'].append("Unable to parse subscription start date")
+
+        self.current_column = "sub_end_date"
+        if row['sub_end_date'] is None or row['sub_end_date'] == '':
+            row['sub_end_date'] = None
+        else:
+            try:
+                if not type(row['sub_end_date']) == datetime.date:
+                    row['sub_end_date'] = try_parsing_date(row['sub_end_date']).date()
+                if row['sub_start_date'] > row['sub_end_date']:
+                    row_errors['data_missing'] = True
+                    row_errors['error_detail'].append("Subscription end date cannot be less than start date")
+            except Exception:
+                row_errors['data_missing'] = True
+                row_errors['error_detail'].append("Unable to parse subscription end date")
+
+        if (row['sub_start_date'] is None) and (row['sub_end_date'] is not None):
+            row_errors["data_missing"] = True
+            row_errors['error_detail'].append("Subscription end date is missing")
+
+        if (row['sub_start_date'] is not None) and (row['sub_end_date'] is None):
+            row_errors["data_missing"] = True
+            row_errors['error_detail'].append("Subscription start date is missing")
+
+        self.current_column = "language"
+        if row['language'] is None or row['language'] == '':
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("Language missing")
+        elif row['language'] not in LANGUAGE_CODES:
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("Unable to parse language")
+
+        row["errors"] = row_errors
+        return waiting_for_hq
+
+    def parse_phone(self, row, row_errors, column, label):
+        if row[column] is None or row[column] == '':
+            return
+        if len(row[column]) > 23:
+            row_errors['phone_number_error'] = True
+            row_errors['error_detail'].append("Could not parse " + column)
+            row[column] = row[column][0:23]
+            return
+        try:
+            phone = PHONE_REGEX.fullmatch(row[column])
+            if not phone:
+                row_errors['phone_number_error'] = True
+                row_errors['error_detail'].append("Could not parse " + column)
+                return
+            country_code = phone.group('country')
+            city_code = phone.group('city')
+            first_part = phone.group('first')
+            second_part = phone.group('second')
+            row[column + "_ext"] = phone.group('ext')
+
+            if country_code == "" and row['country'] == "United States":
+                country_code = '+1'
+                row[column] = country_code + city_code + first_part + second_part
+            elif country_code == "" and row['country'] != "United States":
+                row_errors['phone_number_error'] = True
+                row_errors['error_detail'].append("Country code not provided in " + label)
+            elif country_code != "":
+                row[column] = country_code + city_code + first_part + second_part
+
+        except Exception as e:
+            row_errors['phone_number_error'] = True
+            row_errors['error_detail'].append("Unable to parse " + column)
+
+
+class AccountBulkCreator(object):
+    """
+    Creates a batch of accounts with a fixed number of queries per level of the account tree.
+    Records are sorted so parents are inserted before their subsidiaries, slugs and parents arrays
+    are worked out in memory and the ids returned by each bulk insert are used to link the next
+    level. Accounts that already exist are skipped. Validation errors are raised as ValueError
+    with current_account set to the account number of the offending record; integrity errors from
+    a bulk insert are attributed the same way when the database names the duplicated key.
+    """
+
+    def __init__(self, records, user=None):
+        self.records = records
+        self.user = user
+        self.current_account = None
+        self.existing = {}
+        self.existing_links = {}
+        self.accounts = {}
+        self.links = {}
+
+    def run(self):
+        records = self.prepare()
+        levels = self.sort(records)
+        subscriptions = dict((number, self.build_subscription(record)) for number, record in records.items())
+        self.existing_links = self.load_links(set(
+            self.existing[self.parent_number(record)]['id'] for record in records.values()
+            if self.parent_number(record) in self.existing))
+
+        bases = ['-'.join(slugify(record[field]) for field in ('account_name', 'city') if record.get(field))
+                 for level in levels for record in level]
+        slugs = iter(allocate_slugs(Account, bases))
+
+        with transaction.atomic():
+            for level in levels:
+                self.insert_level(level, slugs)
+
+            AccountHierarchy.objects.bulk_create(
+                [AccountHierarchy(ancestor_id=ancestor_id, descendant_id=self.accounts[number].id, depth=depth)
+                 for number, links in self.links.items() for ancestor_id, depth in links],
+                batch_size=1000)
+
+            # a Head Quarter / Subsidiary without a parent is its own parent
+            Account.objects.filter(
+                pk__in=[account.id for account in self.accounts.values() if account.parent_account_id is None],
+                account_type='hq_sub').update(parent_account=F('id'))
+            # subsidiaries that received a subsidiary of their own
+            Account.objects.filter(
+                pk__in=set(account.parent_account_id for account in self.accounts.values()),
+                account_type='sub').update(account_type='hq_sub')
+
+            for number, subscription in subscriptions.items():
+                if subscription is not None:
+                    subscription.account = self.accounts[number]
+            subscriptions = [subscription for subscription in subscriptions.values() if subscription is not None]
+            assign_slugs(subscriptions)
+            UserSubscription.objects.bulk_create(subscriptions, batch_size=1000)
+            # the accounts were inserted with bulk_create, no signal announced them
+            AccountDropdown.invalidate()
+
+        return list(self.accounts.values())
+
+    def prepare(self):
+        numbers = set()
+        for record in self.records:
+            numbers.add(record.get('account_id'))
+            numbers.add(record.get('parent_account'))
+        numbers.discard(None)
+        self.existing = dict((account['account_id'], account) for account in Account.objects.filter(
+            account_id__in=numbers).values('id', 'account_id', 'account_type', 'parents'))
+
+        records = {}
+        for record in self.records:
+            self.current_account = record.get('account_id')
+            if self.current_account in self.existing:
+                continue
+            if self.current_account in records:
+                raise ValueError("Duplicate entry")
+            if record.get('devices') or record.get('users'):
+                raise ValueError("Devices and users can not be created with bulk account creation")
+
+            record = dict(record)
+            record['account_type'] = ACCOUNT_TYPE_CODES.get(record.get('account_type'), record.get('account_type'))
+            if 'language' in record:
+                record['language'] = LANGUAGE_CODES.get(record['language'], record['language'])
+            records[self.current_account] = record
+        return records
+
+    def parent_number(self, record):
+        parent = record.get('parent_account')
+        if record['account_type'] == 'hq':
+            return None
+        if record['account_type'] == 'hq_sub' and parent in (None, '', record['account_id']):
+            return None
+        return parent
+
+    def sort(self, records):
+        """
+        Groups records into levels, every record coming after the level holding its parent.
+        """
+        levels = []
+        placed = set(self.existing)
+        pending = list(records.values())
+        while pending:
+            level = [record for record in pending if self.parent_number(record) in placed or
+                     self.parent_number(record) is None]
+            if not level:
+                self.current_account = pending[0]['account_id']
+                raise ValueError("Headquarter account does not exist in database or file")
+            levels.append(level)
+            placed.update(record['account_id'] for record in level)
+            pending = [record for record in pending if record['account_id'] not in placed]
+        return levels
+
+    def build_subscription(self, record):
+        self.current_account = record['account_id']
+        if not record.get('user_subscriptions'):
+            return None
+        data = record['user_subscriptions'][0]
+        subscription = UserSubscription(
+            user_start_date=data.get('user_start_date'), user_end_date=data.get('user_end_date'),
+            num_of_users=data.get('num_of_users') or 0, is_cancelled=False, is_active=True)
+        subscription.clean_fields(exclude=[field.name for field in UserSubscription._meta.fields if field.name not in (
+            'user_start_date', 'user_end_date', 'num_of_users')])
+        if subscription.user_start_date >= subscription.user_end_date:
+            raise ValueError("End date should be greater than start date.")
+        return subscription
+
+    def insert_level(self, level, slugs):
+        accounts = []
+        for record in level:
+            self.current_account = record['account_id']
+            account = Account(**dict((field, record[field]) for field in ACCOUNT_BULK_FIELDS if field in record))
+            account.clean_fields(exclude=[field.name for field in Account._meta.fields
+                                          if field.name not in ACCOUNT_BULK_FIELDS or field.name not in record])
+            account.slug = next(slugs)
+            if self.user is not None:
+                account.created_by = account.updated_by = self.user
+
+            parent = self.parent_number(record)
+            if parent in self.accounts:
+                account.parent_account_id = self.accounts[parent].id
+                account.parents = self.accounts[parent].parents + [parent]
+            elif parent is not None:
+                account.parent_account_id = self.existing[parent]['id']
+                account.parents = (self.existing[parent]['parents'] or []) + [parent]
+            accounts.append(account)
+
+        try:
+            Account.objects.bulk_create(accounts)
+        except IntegrityError as e:
+            self.current_account = self.offending_account(e, level, accounts)
+            raise
+
+        for record, account in zip(level, accounts):
+            self.accounts[record['account_id']] = account
+            parent = self.parent_number(record)
+            if parent in self.links:
+                parent_links = self.links[parent]
+            elif parent is not None:
+                parent_links = self.existing_links.get(self.existing[parent]['id'], [])
+            else:
+                parent_links = []
+            self.links[record['account_id']] = [(account.id, 0)] + [
+                (ancestor_id, depth + 1) for ancestor_id, depth in parent_links]
+
+    def offending_account(self, error, level, accounts):
+        # Postgres names the duplicated key in the constraint detail, e.g.
+        # "Key (account_id)=(1234) already exists."; fall back to the whole level.
+        detail = getattr(getattr(error.__cause__, 'diag', None), 'message_detail', None) or str(error)
+        match = CONSTRAINT_KEY.search(detail)
+        if match:
+            field, value = match.groups()
+            for record, account in zip(level, accounts):
+                if str(getattr(account, field, None)) == value:
+                    return record['account_id']
+        return ', '.join(record['account_id'] for record in level)
+
+    def load_links(self, account_ids):
+        links = defaultdict(list)
+        if account_ids:
+            for descendant_id, ancestor_id, depth in AccountHierarchy.objects.filter(
+                    descendant_id__in=account_ids).values_list('descendant_id', 'ancestor_id', 'depth'):
+                links[descendant_id].append((ancestor_id, depth))
+        return links
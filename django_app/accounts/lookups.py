@@ -0,0 +1,19 @@
+from django.db.models import CharField, Lookup
+
+
+@CharField.register_lookup
+class ILikeContains(Lookup):
+    """
+    Case insensitive containment written as ILIKE. Unlike icontains, which compiles to
+    UPPER(column) LIKE UPPER(value), this can be answered from a gin_trgm_ops index on the column.
+    """
+    lookup_name = 'ilike_contains'
+
+    def process_rhs(self, compiler, connection):
+        rhs, params = super().process_rhs(compiler, connection)
+        return rhs, ['%%%s%%' % connection.ops.prep_for_like_query(param) for param in params]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '%s ILIKE %s' % (lhs, rhs), lhs_params + rhs_params
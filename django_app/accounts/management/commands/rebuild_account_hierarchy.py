@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_synergy.accounts.models import AccountHierarchy
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the account hierarchy table from the parent_account links"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            AccountHierarchy.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS("Account hierarchy rebuilt"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from django_synergy.accounts.models import Account
+
+
+class Command(BaseCommand):
+    help = "Recomputes the account admin pointer of every account from the Account Admin group"
+
+    def handle(self, *args, **options):
+        Account.objects.refresh_admins(Account.objects.values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS("Account admins refreshed"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from django_synergy.accounts.models import Account
+
+
+class Command(BaseCommand):
+    help = "Recomputes the used seats of every account from its active users"
+
+    def handle(self, *args, **options):
+        Account.objects.refresh_seats()
+        self.stdout.write(self.style.SUCCESS("Account seats refreshed"))
@@ -0,0 +1,269 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import Count, Exists, F, Q, IntegerField, OuterRef, Prefetch, Subquery
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.translation import gettext as _
+
+
+class AccountQuerySet(models.QuerySet):
+
+    # Both lookups go through an IN subquery rather than a join so the results stay distinct
+    # when they are OR-ed with other account querysets.
+    def descendants_of(self, account, include_self=False):
+        links = self._hierarchy().filter(ancestor=account, depth__gte=0 if include_self else 1)
+        return self.filter(pk__in=links.values('descendant_id'))
+
+    def ancestors_of(self, account, include_self=False):
+        links = self._hierarchy().filter(descendant=account, depth__gte=0 if include_self else 1)
+        return self.filter(pk__in=links.values('ancestor_id'))
+
+    def with_subscription_stats(self):
+        """
+        Annotates the values behind the subscription properties of Account so they can be read
+        for a whole page of accounts without a query per row.
+        """
+        user_subscriptions = self._related('user_subscriptions').filter(
+            is_active=True, is_cancelled=False).order_by('-created_on')
+        devices = self._related('devices').filter(
+            account=OuterRef('pk'), is_active=True).exclude(status='Lost or Broken')
+
+        return self.annotate(
+            annotated_num_device_subscriptions=Coalesce(self._count(devices), 0),
+            annotated_max_user_subscriptions=Subquery(
+                user_subscriptions.filter(account=OuterRef('pk')).values('num_of_users')[:1]),
+        ).prefetch_related(
+            Prefetch('user_subscriptions', queryset=user_subscriptions, to_attr='active_user_subscriptions'))
+
+    def search(self, term):
+        # served by the trigram indexes on account_name and account_id
+        return self.filter(Q(account_name__ilike_contains=term) | Q(account_id__ilike_contains=term))
+
+    def ranked_search(self, term):
+        """
+        Accounts whose name, number, city or domain contain term, annotated with the best trigram
+        similarity of those columns for ordering. The filter is served by the trigram indexes.
+        """
+        fields = ('account_name', 'account_id', 'city', 'domain')
+        matches = Q()
+        for field in fields:
+            matches |= Q(**{field + '__ilike_contains': term})
+        return self.filter(matches).annotate(
+            similarity=Greatest(*[TrigramSimilarity(field, term) for field in fields]))
+
+    def without_active_subscription(self):
+        active_subscriptions = self._related('user_subscriptions').filter(
+            account=OuterRef('pk'), is_active=True, is_cancelled=False)
+        return self.annotate(has_active_subscription=Exists(active_subscriptions)).filter(
+            has_active_subscription=False)
+
+    def _hierarchy(self):
+        return self._related('ancestor_links')
+
+    def _related(self, name):
+        return self.model._meta.get_field(name).related_model.objects
+
+    @staticmethod
+    def _count(queryset):
+        return Subquery(queryset.order_by().values('account').annotate(count=Count('id')).values('count'),
+                        output_field=IntegerField())
+
+
+class AccountManager(models.Manager.from_queryset(AccountQuerySet)):
+
+    def resolve_admins(self, account_ids):
+        """
+        Returns {account id: account admin or None} for the given accounts in one query.
+        """
+        accounts = self.filter(pk__in=[account_id for account_id in account_ids if account_id is not None])
+        return {account.id: account.admin for account in accounts.select_related('admin')}
+
+    def reparent(self, account, parent):
+        """
+        Moves account with its whole subtree below parent, updating the hierarchy, the parents
+        arrays and the account types of both accounts in a fixed number of statements.
+        """
+        hierarchy = self.model._meta.get_field('ancestor_links').related_model.objects
+        subtree = hierarchy.filter(ancestor=account).aggregate(
+            descendants=Count('pk', filter=Q(depth__gt=0)),
+            contains_parent=Count('pk', filter=Q(descendant=parent)))
+        if subtree['contains_parent']:
+            raise ValueError(_("An account can not be acquired by one of its own subsidiaries"))
+
+        if parent.account_type == "sub":
+            parent.account_type = "hq_sub"
+        elif parent.account_type == "hq_sub":
+            parent.account_type = "hq"
+
+        if account.account_type == "hq" and subtree['descendants'] > 0:
+            account.account_type = "hq_sub"
+        elif account.account_type in ("hq", "hq_sub") and subtree['descendants'] == 0:
+            account.account_type = "sub"
+        account.parent_account = parent
+
+        with transaction.atomic():
+            account.save(update_fields=['parent_account', 'account_type', 'updated_on'])
+            parent.save(update_fields=['account_type', 'updated_on'])
+            hierarchy.move_subtree(account)
+            hierarchy.rewrite_parents(account)
+
+    def refresh_admins(self, account_ids):
+        account_ids = set(account_id for account_id in account_ids if account_id is not None)
+        if not account_ids:
+            return
+        # the first Account Admin of each account, in one UPDATE
+        account_admins = self.model._meta.get_field('admin').related_model.objects.filter(
+            account_id=OuterRef('pk'), groups__name__contains="Account Admin").order_by('id')
+        self.filter(pk__in=account_ids).update(admin_id=Subquery(account_admins.values('id')[:1]))
+
+    def claim_seat(self, user, require_subscription=False):
+        """
+        Marks an inactive user active, taking a seat on their account when its active subscription
+        has one free. The seat is taken with one conditional UPDATE so concurrent activations can
+        not overshoot the limit. Returns False and leaves the user inactive when the account is
+        full. An account without an active subscription has no limit to enforce, the user is
+        activated unless require_subscription is set. The caller saves the user in the same
+        transaction.
+        """
+        if user.is_active:
+            return True
+        if user.account_id is not None:
+            subscriptions = self.model._meta.get_field('user_subscriptions').related_model.objects.filter(
+                is_active=True, is_cancelled=False).order_by('-created_on')
+            if subscriptions.filter(account_id=user.account_id).exists():
+                seat_limit = subscriptions.filter(account=OuterRef('pk')).values('num_of_users')[:1]
+                claimed = self.filter(pk=user.account_id, seats_used__lt=Subquery(seat_limit)).update(
+                    seats_used=F('seats_used') + 1)
+                if not claimed:
+                    return False
+                # already counted, count_user_seat skips it
+                user._claimed_seat = user.account_id
+            elif require_subscription:
+                return False
+        user.is_active = True
+        return True
+
+    def move_seat(self, from_account_id, to_account_id):
+        """
+        Moves an active user's seat between accounts, either side may be None.
+        """
+        if from_account_id is not None:
+            self.filter(pk=from_account_id).update(seats_used=F('seats_used') - 1)
+        if to_account_id is not None:
+            self.filter(pk=to_account_id).update(seats_used=F('seats_used') + 1)
+
+    def refresh_seats(self):
+        users = self.model._meta.get_field('users').related_model.objects.filter(
+            account=OuterRef('pk'), is_active=True)
+        self.update(seats_used=Coalesce(AccountQuerySet._count(users), 0))
+
+
+class AccountHierarchyManager(models.Manager):
+
+    def insert_node(self, account):
+        # an hq_sub without a parent points at itself, treat it as a root
+        links = [self.model(ancestor_id=account.id, descendant_id=account.id, depth=0)]
+        if account.parent_account_id and account.parent_account_id != account.id:
+            ancestors = self.filter(descendant_id=account.parent_account_id).values_list('ancestor_id', 'depth')
+            links += [self.model(ancestor_id=ancestor_id, descendant_id=account.id, depth=depth + 1)
+                      for ancestor_id, depth in ancestors]
+        self.bulk_create(links, ignore_conflicts=True)
+
+    def move_subtree(self, account):
+        """
+        Re-links the subtree rooted at account below its current parent_account.
+        """
+        params = {'node': account.id, 'parent': account.parent_account_id}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {table} WHERE descendant_id IN '
+                '(SELECT descendant_id FROM {table} WHERE ancestor_id = %(node)s) '
+                'AND ancestor_id NOT IN '
+                '(SELECT descendant_id FROM {table} WHERE ancestor_id = %(node)s)'.format(table=self.model._meta.db_table),
+                params)
+            if account.parent_account_id and account.parent_account_id != account.id:
+                cursor.execute(
+                    'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+                    'SELECT supertree.ancestor_id, subtree.descendant_id, supertree.depth + subtree.depth + 1 '
+                    'FROM {table} supertree, {table} subtree '
+                    'WHERE supertree.descendant_id = %(parent)s AND subtree.ancestor_id = %(node)s'.format(
+                        table=self.model._meta.db_table),
+                    params)
+
+    def rewrite_parents(self, account):
+        """
+        Recomputes the parents array, root first, of account and every account below it.
+        """
+        account_table = self.model._meta.get_field('ancestor').related_model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {accounts} AS account SET parents = ancestry.parents FROM ('
+                'SELECT link.descendant_id, COALESCE(jsonb_agg(ancestor.account_id ORDER BY link.depth DESC) '
+                'FILTER (WHERE link.depth > 0), \'[]\'::jsonb) AS parents '
+                'FROM {table} link JOIN {accounts} ancestor ON ancestor.id = link.ancestor_id '
+                'WHERE link.descendant_id IN (SELECT descendant_id FROM {table} WHERE ancestor_id = %(node)s) '
+                'GROUP BY link.descendant_id) AS ancestry '
+                'WHERE account.id = ancestry.descendant_id'.format(
+                    accounts=account_table, table=self.model._meta.db_table),
+                {'node': account.id})
+
+    def rebuild(self):
+        account_table = self.model._meta.get_field('ancestor').related_model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {table}'.format(table=self.model._meta.db_table))
+            cursor.execute(
+                'WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS ('
+                'SELECT id, id, 0 FROM {accounts} '
+                'UNION ALL '
+                'SELECT tree.ancestor_id, account.id, tree.depth + 1 FROM tree '
+                'JOIN {accounts} account ON account.parent_account_id = tree.descendant_id '
+                'AND account.parent_account_id <> account.id) '
+                'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+                'SELECT ancestor_id, descendant_id, depth FROM tree'.format(
+                    accounts=account_table, table=self.model._meta.db_table))
+
+
+class NotificationOutboxManager(models.Manager):
+
+    def enqueue(self, action, kind='user', **kwargs):
+        """
+        Records a notification in the current transaction, it is sent by the dispatch_notifications
+        task once the transaction commits and dropped with it on rollback. Takes the arguments of
+        the generator for its kind: generate_user_notification for 'user',
+        generate_account_notification for 'account', generate_case_user_notification for
+        'case_user', generate_case_notification for 'case' and send_account_status_notification
+        for 'account_status'.
+        """
+        entry = self.build(action, kind=kind, **kwargs)
+        entry.save()
+        transaction.on_commit(self._schedule_dispatch)
+        return entry
+
+    def bulk_enqueue(self, entries):
+        """
+        Records notifications made with build() in one statement and schedules a single dispatch.
+        """
+        entries = self.bulk_create(entries)
+        if entries:
+            transaction.on_commit(self._schedule_dispatch)
+        return entries
+
+    def build(self, action, kind='user', to_user=None, from_user=None, to_user_id=None, from_user_id=None,
+              to_account_id=None, **payload):
+        entry = self.model(
+            kind=kind, action=action, to_account_id=to_account_id, payload=payload,
+            to_user_id=to_user.id if to_user is not None else to_user_id,
+            from_user_id=from_user.id if from_user is not None else from_user_id)
+        entry.dedup_key = hashlib.sha1(json.dumps(
+            [entry.kind, entry.action, entry.to_user_id, entry.to_account_id, entry.from_user_id, entry.payload],
+            sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+        return entry
+
+    @staticmethod
+    def _schedule_dispatch():
+        # imported here, the tasks module imports the models
+        from .tasks import dispatch_notifications
+        dispatch_notifications.delay()
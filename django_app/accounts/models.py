@@ -2,15 +2,23 @@ from uuid import uuid4
 from django.utils.translation import ugettext_lazy as _
 from datetime import date
 from django.db import models
+from django.db.models import Q
+from django.core.cache import cache
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.contrib.postgres.fields import JSONField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.postgres.indexes import GinIndex
 
 from django_extensions.db.fields import AutoSlugField
 
 from django_synergy.utils.models.base import AbstractBaseModel
 
+from . import lookups  # noqa F401
+from .manager import AccountManager, AccountHierarchyManager, NotificationOutboxManager
+
 
 # User = get_user_model()
 
@@ -38,6 +46,9 @@ def user_directory_path(instance, filename):
     return '{0}/account_import/{1}'.format(settings.S3_ENVIRON, '{0}_{1}.{2}'.format(name, uuid4(), ext))
 
 
+ASSOCIATED_IDS_CACHE_KEY = 'account-associated-ids-{0}'
+
+
 ACCOUNT_TYPES = [
     ('hq', 'Head Quarter'),
     ('sub', 'Subsidiary'),
@@ -79,35 +90,71 @@ class Account(AbstractBaseModel):
     # JSON Field to hold a list of all parent accounts
     parents = JSONField(default=list())
     is_active = models.BooleanField(default=False)
+    # Active users of the account, kept current by the user signals
+    seats_used = models.PositiveIntegerField(default=0)
+    # Member of the "Account Admin" group, kept current by the group membership signals
+    admin = models.ForeignKey(
+        "users.User", related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+
+    objects = AccountManager()
 
     @property
     def account_admin(self):
-        account_admin = self.users.filter(
-            groups__name__contains="Account Admin").all()
-        if account_admin:
-            return account_admin[0].first_name + ' ' + account_admin[0].last_name
+        if self.admin_id is not None:
+            return self.admin.first_name + ' ' + self.admin.last_name
         else:
-            None
+            return None
 
     @property
     def account_admin_id(self):
-        account_admin = self.users.filter(
-            groups__name__contains="Account Admin").all()
-        if account_admin:
-            return account_admin[0].id
-        else:
-            None
+        return self.admin_id
+
+    def associated_ids(self, include_pending=False):
+        """
+        Ids of the accounts with an accepted association to this account, in either direction,
+        or with any association when include_pending is set. Cached until one of the account's
+        associations is saved or deleted.
+        """
+        if not hasattr(self, '_associated_ids'):
+            key = ASSOCIATED_IDS_CACHE_KEY.format(self.pk)
+            associated_ids = cache.get(key)
+            if associated_ids is None:
+                associations = AssociatedAccounts.objects.filter(Q(from_account_id=self.pk) | Q(to_account_id=self.pk))
+                accepted, pending = set(), set()
+                for from_account_id, to_account_id, is_accepted in associations.values_list(
+                        'from_account_id', 'to_account_id', 'accepted'):
+                    other_id = to_account_id if from_account_id == self.pk else from_account_id
+                    (accepted if is_accepted else pending).add(other_id)
+                associated_ids = (frozenset(accepted), frozenset(pending - accepted))
+                cache.set(key, associated_ids, None)
+            self._associated_ids = associated_ids
+        accepted, pending = self._associated_ids
+        return accepted | pending if include_pending else accepted
 
     @property
     def num_device_subscriptions(self):
+        if hasattr(self, 'annotated_num_device_subscriptions'):
+            return self.annotated_num_device_subscriptions
         return self.devices.filter(is_active=True,).exclude(status='Lost or Broken').count()
 
     @property
     def num_user_subscriptions(self):
-        return self.users.filter(is_active=True).count()
+        return self.seats_used
+
+    def has_free_seat(self):
+        """
+        Whether another user can be activated. A check only, activations take their seat with
+        Account.objects.claim_seat().
+        """
+        max_user_subscriptions = self.max_user_subscriptions
+        return max_user_subscriptions is not None and self.seats_used < max_user_subscriptions
 
     @property
     def current_active_subscription(self):
+        # populated by Account.objects.with_subscription_stats()
+        if hasattr(self, 'active_user_subscriptions'):
+            return self.active_user_subscriptions[0] if self.active_user_subscriptions else None
+
         user_subscriptions = self.user_subscriptions.order_by('-created_on').all()
         current_date = date.today()
         current_active_sub = user_subscriptions.filter(is_active=True, is_cancelled=False)
@@ -119,6 +166,8 @@ class Account(AbstractBaseModel):
 
     @property
     def max_user_subscriptions(self):
+        if hasattr(self, 'annotated_max_user_subscriptions'):
+            return self.annotated_max_user_subscriptions
         current_active_sub = self.current_active_subscription
         if current_active_sub is not None:
             return current_active_sub.num_of_users
@@ -133,6 +182,16 @@ class Account(AbstractBaseModel):
         #     return current_active_sub[0].num_of_users
 
     class Meta:
+        # type-ahead search, requires the pg_trgm extension
+        indexes = [
+            GinIndex(name='account_name_trgm', fields=['account_name'], opclasses=['gin_trgm_ops']),
+            GinIndex(name='account_id_trgm', fields=['account_id'], opclasses=['gin_trgm_ops']),
+            GinIndex(name='account_city_trgm', fields=['city'], opclasses=['gin_trgm_ops']),
+            GinIndex(name='account_domain_trgm', fields=['domain'], opclasses=['gin_trgm_ops']),
+        ]
+        constraints = [
+            models.CheckConstraint(name='account_seats_used_non_negative', check=Q(seats_used__gte=0)),
+        ]
         default_permissions = ()
         permissions = [
             ("account-view-own", _("Can view their own account")),
@@ -159,6 +218,20 @@ class Account(AbstractBaseModel):
         ]
 
 
+class AccountHierarchy(models.Model):
+    # Closure table of the account tree, one row for every (ancestor, descendant) pair including
+    # the account itself at depth 0. Kept plain so it can be maintained with set based statements.
+    ancestor = models.ForeignKey('Account', on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey('Account', on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    objects = AccountHierarchyManager()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        default_permissions = ()
+
+
 class AssociatedAccounts(AbstractBaseModel):
     from_account = models.ForeignKey(
         'Account', on_delete=models.PROTECT, related_name="from_account")
@@ -183,6 +256,12 @@ class UserSubscription(AbstractBaseModel):
     is_cancelled = models.BooleanField(default=False, null=True)
     is_active = models.BooleanField(default=False, null=True)
 
+    class Meta:
+        indexes = [
+            # the current subscription of an account, see Account.current_active_subscription
+            models.Index(name='user_subscription_current', fields=['account', 'is_active', 'created_on']),
+        ]
+
 
 class DeviceSubscription(AbstractBaseModel):
     account = models.ForeignKey("accounts.Account", on_delete=models.PROTECT,
@@ -192,13 +271,104 @@ class DeviceSubscription(AbstractBaseModel):
                          'account__account_name'], slugify_function=slugify_device_sub)
 
 
+NOTIFICATION_KINDS = [
+    ('user', 'User notification'),
+    ('account', 'Account notification'),
+    ('case_user', 'Case user notification'),
+    ('case', 'Case notification'),
+    ('account_status', 'Account status notification'),
+]
+
+
+class NotificationOutbox(models.Model):
+    # Notifications written in the same transaction as the change they announce, drained in
+    # batches by the dispatch_notifications task
+    kind = models.CharField(choices=NOTIFICATION_KINDS, max_length=20, default='user')
+    action = models.CharField(max_length=255)
+    to_user = models.ForeignKey("users.User", related_name='+', on_delete=models.CASCADE, blank=True, null=True)
+    to_account = models.ForeignKey('Account', related_name='+', on_delete=models.CASCADE, blank=True, null=True)
+    from_user = models.ForeignKey("users.User", related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    payload = JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # identical notifications pending at the same time are sent once
+    dedup_key = models.CharField(max_length=40)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    # set while a dispatcher is sending the entry, a stale claim is taken over after a timeout
+    claimed_on = models.DateTimeField(null=True, blank=True)
+    dispatched_on = models.DateTimeField(null=True, blank=True)
+
+    objects = NotificationOutboxManager()
+
+    class Meta:
+        indexes = [
+            models.Index(name='notification_outbox_pending', fields=['id'], condition=Q(dispatched_on__isnull=True)),
+        ]
+        default_permissions = ()
+
+
+IMPORT_STATUS = [
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+]
+
+
+class AbstractImportJob(models.Model):
+    # Progress of the background task that parses and validates an upload
+    status = models.CharField(choices=IMPORT_STATUS, max_length=20, default='pending')
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    processed_rows = models.PositiveIntegerField(default=0)
+    error_rows = models.PositiveIntegerField(default=0)
+    started_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+    failure_message = models.TextField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def eta(self):
+        """
+        Seconds until the remaining rows are processed at the rate seen so far.
+        """
+        if self.status != 'running' or not self.total_rows or not self.processed_rows:
+            return None
+        elapsed = (timezone.now() - self.started_on).total_seconds()
+        return round(elapsed / self.processed_rows * max(self.total_rows - self.processed_rows, 0))
+
+    def start(self, total_rows):
+        self._update_job(status='running', total_rows=total_rows, processed_rows=0, error_rows=0,
+                         started_on=timezone.now(), finished_on=None, failure_message=None)
+
+    def report_progress(self, processed_rows, error_rows):
+        self._update_job(processed_rows=processed_rows, error_rows=error_rows)
+
+    def complete(self):
+        fields = {'status': 'completed', 'finished_on': timezone.now()}
+        if self.total_rows is None:
+            # not known up front for csv uploads
+            fields['total_rows'] = self.processed_rows
+        self._update_job(**fields)
+
+    def fail(self, message):
+        self._update_job(status='failed', finished_on=timezone.now(), failure_message=message)
+
+    def _update_job(self, **fields):
+        # single column update so progress writes never overwrite the upload itself
+        for name, value in fields.items():
+            setattr(self, name, value)
+        type(self)._default_manager.filter(pk=self.pk).update(**fields)
+
+
 def validate_upload(value):
     # Probably worth doing this check first anyway
     if not value.name.endswith(('.csv', '.xlsx')):
         raise ValidationError('Invalid file type')
 
 
-class AccountUpload(AbstractBaseModel):
+class AccountUpload(AbstractBaseModel, AbstractImportJob):
     _key_prefix = settings.DEVICE_IMPORT_KEY_PREFIX
 
     upload = models.FileField(
@@ -0,0 +1,11 @@
+from rest_framework.pagination import CursorPagination
+
+
+class AccountSearchPagination(CursorPagination):
+    # cursor over the rank: the cursor carries the last similarity (and an offset for ties), so
+    # pages stay stable while rows change, but similarity is computed per query and every page
+    # still ranks all the matches the trigram indexes return
+    ordering = ('-similarity', 'id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
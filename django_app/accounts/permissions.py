@@ -1,6 +1,7 @@
+from django.db.models import Q
 from rest_framework import permissions
 
-from django_synergy.accounts.models import Account
+from django_synergy.accounts.models import AccountHierarchy
 from django_synergy.utils.permissions import get_user_permission_list, user_has_permission
 
 
@@ -21,6 +22,59 @@ class CanViewAccountList(permissions.IsAuthenticated):
             return False
 
 
+class AccountListScope(object):
+    """
+    Compiles the account-list permissions of a user into one predicate on Account, so a list is
+    a single query whichever permissions the user holds. The subtree is an IN subquery on the
+    hierarchy, planned as a semi-join, and the associations come from the cached id set.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def filter(self, queryset):
+        predicate = self.predicate()
+        if predicate is None:
+            return queryset.none()
+        return queryset.filter(predicate)
+
+    def predicate(self):
+        """
+        Returns Q() when every account is visible and None when none is.
+        """
+        user = self.user
+        if user.is_superuser:
+            return Q()
+
+        user_permissions = get_user_permission_list(user)
+        if user_has_permission('account-list-all', user_permissions):
+            return Q()
+
+        account = getattr(user, 'account', None)
+        if account is None:
+            return None
+
+        clauses = []
+        if user_has_permission('account-view-own', user_permissions):
+            clauses.append(Q(pk=account.id))
+        if user_has_permission('account-list-subsidiary', user_permissions):
+            clauses.append(Q(pk__in=AccountHierarchy.objects.filter(
+                ancestor_id=account.id, depth__gte=1).values('descendant_id')))
+        if user_has_permission('account-list-hq', user_permissions) and account.parent_account_id:
+            clauses.append(Q(parent_account_id=account.parent_account_id))
+        if user_has_permission('account-list-associated', user_permissions):
+            associated_ids = account.associated_ids()
+            if associated_ids:
+                clauses.append(Q(pk__in=associated_ids))
+
+        if not clauses:
+            return None
+        predicate = clauses[0]
+        for clause in clauses[1:]:
+            predicate |= clause
+        return predicate
+
+
 class CanViewAccountDetail(permissions.IsAuthenticated):
     message = 'This API is only accessible to an super user or user that has permission.'
 
@@ -53,16 +107,8 @@ class CanViewAccountDetail(permissions.IsAuthenticated):
                                user_permissions) and obj.parent_account == user.account:
             return True
         if user_has_permission('account-view-detail-associated', user_permissions):
-            to_account_association = user.account.to_account.filter(
-                accepted=True).all()
-            from_account_association = user.account.from_account.filter(
-                accepted=True).all()
-            for acc in to_account_association:
-                if obj == acc.from_account:
-                    return True
-            for acc in from_account_association:
-                if obj == acc.to_account:
-                    return True
+            if obj.id in user.account.associated_ids():
+                return True
         if user_has_permission('account-view-detail-hq',
                                user_permissions) and obj == user.account.parent_account:
             return True
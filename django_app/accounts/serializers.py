@@ -17,6 +17,12 @@ class DropDownAccountSerializer(BaseSerializer):
         fields = ('account_id', 'account_name', 'slug', 'domain', 'account_type', 'language', 'is_active')
 
 
+class AccountSearchSerializer(BaseSerializer):
+    class Meta:
+        model = Account
+        fields = ('account_id', 'account_name', 'slug', 'city', 'domain', 'account_type', 'is_active')
+
+
 # used for relationships
 class MinifiedAccountSerializer(BaseSerializer):
     parent_account = serializers.SlugRelatedField(
@@ -129,7 +135,13 @@ class AccountSerializer(BaseSerializer):
         return obj.get_account_type_display()
 
     def get_subsidiaries(self, obj):
-        queryset = Account.objects.filter(parents__contains=obj.account_id)
+        # ?expand= lists the optional sections to include, all of them when it is not given
+        request = self.context.get('request')
+        expand = request.query_params.get('expand') if request else None
+        if expand is not None and 'subsidiaries' not in expand.split(','):
+            return None
+
+        queryset = Account.objects.descendants_of(obj).prefetch_related('associated_accounts', 'associated_contacts')
         return AccountWritableSerializer(queryset, many=True).data
 
     def get_user_subscriptions(self, obj):
@@ -257,8 +269,8 @@ class AccountReadOnlySerializer(BaseSerializer):
 
         if is_hq is not False:
             if (
-                (obj.account_type == 'hq' or obj.account_type == 'hq_sub') and Account.objects.filter(
-                parents__contains=obj.account_id).exists()):
+                (obj.account_type == 'hq' or obj.account_type == 'hq_sub') and Account.objects.descendants_of(
+                obj).exists()):
                 if obj.account_type == 'hq':
                     return "collapsed"
                 if obj.account_type == 'hq_sub' and not obj.account_id == obj.parent_account.account_id:
@@ -294,6 +306,7 @@ class AccountWritableSerializer(BaseSerializer):
             'domain',
             'slug',
             'parent_account',
+            'admin',
         ]
         lookup_field = 'slug'
 
@@ -539,6 +552,7 @@ class AccountUploadSerializer(BaseSerializer):
             "upload",
             "slug",
             'id',
+            "status",
             "items"
         )
 
@@ -553,6 +567,25 @@ class AccountUploadWritableSerializer(BaseSerializer):
         )
 
 
+class AccountUploadProgressSerializer(BaseSerializer):
+    eta = serializers.ReadOnlyField()
+
+    class Meta:
+        model = AccountUpload
+        lookup_field = 'slug'
+        fields = (
+            'id',
+            "status",
+            "total_rows",
+            "processed_rows",
+            "error_rows",
+            "eta",
+            "started_on",
+            "finished_on",
+            "failure_message",
+        )
+
+
 class AssociatedContactsWritableSerializer(BaseSerializer):
     from_user = serializers.SlugRelatedField(
         slug_field="slug", queryset=User.objects.filter(user_type="Contact"))
@@ -0,0 +1,94 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import ASSOCIATED_IDS_CACHE_KEY, Account, AccountHierarchy, AssociatedAccounts
+from .utils import AccountDropdown
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Account)
+def add_account_to_hierarchy(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AccountHierarchy.objects.insert_node(instance)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_account_dropdowns(sender, instance, raw=False, **kwargs):
+    if not raw:
+        AccountDropdown.invalidate()
+
+
+@receiver(post_save, sender=AssociatedAccounts)
+@receiver(post_delete, sender=AssociatedAccounts)
+def invalidate_associated_ids(sender, instance, **kwargs):
+    keys = [ASSOCIATED_IDS_CACHE_KEY.format(instance.from_account_id),
+            ASSOCIATED_IDS_CACHE_KEY.format(instance.to_account_id)]
+    # after commit, so a concurrent read can not cache the old set again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_init, sender=User)
+def remember_user_account(sender, instance, **kwargs):
+    # read from __dict__ so deferred loads do not trigger a query per instance
+    instance._loaded_account_id = instance.__dict__.get('account_id')
+    instance._loaded_is_active = instance.__dict__.get('is_active')
+
+
+# registered before refresh_admin_on_account_change, which resets _loaded_account_id
+@receiver(post_save, sender=User)
+def count_user_seat(sender, instance, created, raw=False, **kwargs):
+    loaded_is_active = getattr(instance, '_loaded_is_active', None)
+    if raw or (not created and loaded_is_active is None):
+        return
+    loaded_seat = instance._loaded_account_id if loaded_is_active and not created else None
+    seat = instance.account_id if instance.is_active else None
+    claimed_seat = instance.__dict__.pop('_claimed_seat', None)
+    if loaded_seat != seat:
+        Account.objects.move_seat(loaded_seat, None if seat == claimed_seat else seat)
+    instance._loaded_is_active = instance.is_active
+
+
+@receiver(post_delete, sender=User)
+def release_user_seat(sender, instance, **kwargs):
+    if instance.is_active and instance.account_id is not None:
+        Account.objects.move_seat(instance.account_id, None)
+
+
+@receiver(post_save, sender=User)
+def refresh_admin_on_account_change(sender, instance, created, raw=False, **kwargs):
+    loaded_account_id = getattr(instance, '_loaded_account_id', None)
+    if raw or created or loaded_account_id == instance.account_id:
+        return
+    Account.objects.refresh_admins([loaded_account_id, instance.account_id])
+    instance._loaded_account_id = instance.account_id
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def refresh_admin_on_group_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse and "Account Admin" in instance.name:
+            # Group.user_set.clear() sends no pk_set, remember the members it is about to drop
+            instance._cleared_user_ids = set(instance.user_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        # User.groups changed, pk_set holds group ids (None when cleared)
+        if pk_set and not Group.objects.filter(pk__in=pk_set, name__contains="Account Admin").exists():
+            return
+        Account.objects.refresh_admins([instance.account_id])
+        AccountDropdown.forget_admin([instance.pk])
+    elif "Account Admin" in instance.name:
+        # Group.user_set changed, pk_set holds user ids
+        if action == 'post_clear':
+            pk_set = instance.__dict__.pop('_cleared_user_ids', None)
+        if pk_set:
+            Account.objects.refresh_admins(User.objects.filter(pk__in=pk_set).values_list('account_id', flat=True))
+            AccountDropdown.forget_admin(pk_set)
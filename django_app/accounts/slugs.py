@@ -0,0 +1,67 @@
+from re import escape, sub
+
+from django.db.models import Q
+
+# the longest suffix a slug is expected to get, "-" and up to seven digits
+SLUG_SUFFIX_LENGTH = 8
+# shorter bases are matched with an anchored pattern, a prefix that short would match most slugs
+SLUG_PREFIX_MIN_LENGTH = 3
+
+
+def allocate_slugs(model, bases, field_name='slug'):
+    """
+    Returns a unique slug for each of bases following the base, base-2, base-3 ... scheme of
+    AutoSlugField, looking up the slugs already taken with one query for the whole batch.
+    """
+    max_length = model._meta.get_field(field_name).max_length
+    bases = [sub('-+', '-', base).strip('-')[:max_length] for base in bases]
+    prefixes = Q()
+    for base in set(bases):
+        if len(base) > max_length - SLUG_SUFFIX_LENGTH:
+            # suffixed slugs of a base at max_length are cut short, match on a shorter prefix
+            prefixes |= Q(**{field_name + '__startswith': base[:max_length - SLUG_SUFFIX_LENGTH]})
+        elif len(base) < SLUG_PREFIX_MIN_LENGTH:
+            prefixes |= Q(**{field_name + '__regex': r'^{0}(-[0-9]+)?$'.format(escape(base))})
+        else:
+            prefixes |= Q(**{field_name: base}) | Q(**{field_name + '__startswith': base + '-'})
+    taken = set(model._default_manager.filter(prefixes).values_list(field_name, flat=True)) if bases else set()
+
+    slugs = []
+    for base in bases:
+        slug, suffix = base, 2
+        while slug in taken:
+            end = '-' + str(suffix)
+            slug = base[:max_length - len(end)].strip('-') + end
+            suffix += 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def slug_base(instance, field_name='slug'):
+    """
+    The slug AutoSlugField would start from for instance, built from its populate_from values.
+    Related lookups are read from the objects attached to instance, attach them beforehand to
+    avoid a query per instance.
+    """
+    field = instance._meta.get_field(field_name)
+    populate_from = field._populate_from
+    if not isinstance(populate_from, (list, tuple)):
+        populate_from = (populate_from,)
+    return field.separator.join(
+        field.slugify_func(field.get_slug_fields(instance, lookup_value)) for lookup_value in populate_from)
+
+
+def assign_slugs(instances, field_name='slug'):
+    """
+    Sets a unique slug on every instance without one so they can be saved with bulk_create,
+    which does not run the uniqueness probes of AutoSlugField. Slugs are reserved in memory,
+    a concurrent insert of the same base fails on the unique index rather than duplicating.
+    """
+    instances = [instance for instance in instances if not getattr(instance, field_name)]
+    if not instances:
+        return
+    slugs = allocate_slugs(type(instances[0]), [slug_base(instance, field_name) for instance in instances],
+                           field_name=field_name)
+    for instance, slug in zip(instances, slugs):
+        setattr(instance, field_name, slug)
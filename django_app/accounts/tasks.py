@@ -0,0 +1,186 @@
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+
+from config import celery_app
+
+from django_synergy.notifications.utils import generate_user_notification, generate_account_notification, \
+    generate_case_user_notification, generate_case_notification
+from django_synergy.users.models import User
+
+from django_synergy.devices.models import Device
+
+from .importers import AccountImporter, count_rows
+from .models import Account, AccountUpload, NotificationOutbox, UserSubscription
+from .utils import AccountDropdown
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_WORKERS = 4
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_CLAIM_TIMEOUT = timedelta(minutes=10)
+SUBSCRIPTION_SWEEP_INTERVAL = 60.0 * 60
+
+
+@celery_app.task()
+def send_account_status_notification(account_id, from_user_id, is_active):
+    account = Account.objects.with_subscription_stats().select_related('admin').get(pk=account_id)
+    if account.admin is None:
+        return
+    # the subscription sweeper deactivates accounts on its own
+    from_user = User.objects.get(pk=from_user_id) if from_user_id is not None else None
+
+    if is_active:
+        current_subscription = account.current_active_subscription
+        generate_user_notification(
+            action="Account Activation", to_user=account.admin, from_user=from_user,
+            number_of_users=account.max_user_subscriptions,
+            subscription_end_date=current_subscription.user_end_date if current_subscription else None)
+    else:
+        generate_user_notification(
+            action="Account Deactivation", to_user=account.admin, from_user=from_user,
+            phone_number="+145623409123")
+
+
+@celery_app.task()
+def import_account_upload(account_upload_id):
+    account_upload = AccountUpload.objects.get(pk=account_upload_id)
+    try:
+        with account_upload.upload.open('rb') as file:
+            account_upload.start(count_rows(file, account_upload.upload.name))
+            AccountImporter(account_upload).run(file, account_upload.upload.name)
+    except ParseError as e:
+        account_upload.fail(str(e.detail))
+        return
+    except Exception as e:
+        account_upload.fail(str(e))
+        raise
+    account_upload.complete()
+
+
+def send_outbox_entry(entry, users):
+    """
+    Sends one outbox entry, returning the error message when sending failed.
+    """
+    try:
+        if entry.kind == 'user':
+            generate_user_notification(action=entry.action, to_user=users.get(entry.to_user_id),
+                                       from_user=users.get(entry.from_user_id), **entry.payload)
+        elif entry.kind == 'account':
+            generate_account_notification(action=entry.action, to_account_id=entry.to_account_id,
+                                          from_user_id=entry.from_user_id, **entry.payload)
+        elif entry.kind == 'case_user':
+            generate_case_user_notification(action=entry.action, to_user_id=entry.to_user_id,
+                                            from_user_id=entry.from_user_id, **entry.payload)
+        elif entry.kind == 'case':
+            generate_case_notification(action=entry.action, from_user_id=entry.from_user_id, **entry.payload)
+        elif entry.kind == 'account_status':
+            send_account_status_notification(entry.to_account_id, entry.from_user_id, **entry.payload)
+    except Exception as e:
+        logger.exception("Unable to send notification %s", entry.id)
+        return str(e)
+    finally:
+        # runs on a pool thread, which has a connection of its own
+        connection.close()
+
+
+def claim_notifications(last_id):
+    """
+    Claims the next batch of pending outbox entries together with every other pending entry that
+    shares one of their dedup keys, grouped by dedup key. Runs in a transaction of its own so the
+    row locks are released before anything is sent.
+    """
+    now = timezone.now()
+    claimable = NotificationOutbox.objects.select_for_update(skip_locked=True).filter(
+        Q(claimed_on__isnull=True) | Q(claimed_on__lt=now - NOTIFICATION_CLAIM_TIMEOUT),
+        dispatched_on__isnull=True, attempts__lt=NOTIFICATION_MAX_ATTEMPTS)
+    with transaction.atomic():
+        batch = list(claimable.filter(id__gt=last_id).order_by('id')[:NOTIFICATION_BATCH_SIZE])
+        if not batch:
+            return OrderedDict()
+        duplicates = claimable.filter(dedup_key__in=set(entry.dedup_key for entry in batch)).exclude(
+            pk__in=[entry.id for entry in batch])
+
+        groups = OrderedDict()
+        for entry in batch + list(duplicates.order_by('id')):
+            groups.setdefault(entry.dedup_key, []).append(entry)
+        NotificationOutbox.objects.filter(pk__in=[entry.id for group in groups.values() for entry in group]).update(
+            claimed_on=now, attempts=F('attempts') + 1)
+    return groups
+
+
+@celery_app.task()
+def dispatch_notifications():
+    """
+    Drains the notification outbox in batches. Each batch is claimed in a short transaction with
+    SKIP LOCKED so concurrent dispatchers split the work, identical pending entries are sent once
+    with a bounded number of threads outside of any transaction and the outcome is recorded in a
+    second short transaction. Entries whose outcome was never recorded are claimed again once
+    their claim times out.
+    """
+    last_id = 0
+    while True:
+        groups = claim_notifications(last_id)
+        if not groups:
+            return
+        last_id = max(group[0].id for group in groups.values())
+
+        entries = [group[0] for group in groups.values()]
+        users = User.objects.in_bulk(
+            set(entry.to_user_id for entry in entries if entry.kind == 'user') |
+            set(entry.from_user_id for entry in entries if entry.kind == 'user'))
+        with ThreadPoolExecutor(max_workers=NOTIFICATION_WORKERS) as executor:
+            errors = list(executor.map(lambda entry: send_outbox_entry(entry, users), entries))
+
+        sent, failed = [], OrderedDict()
+        for group, error in zip(groups.values(), errors):
+            if error is None:
+                sent += [entry.id for entry in group]
+            else:
+                failed.setdefault(error, []).extend(entry.id for entry in group)
+        with transaction.atomic():
+            NotificationOutbox.objects.filter(pk__in=sent).update(dispatched_on=timezone.now(), claimed_on=None)
+            for error, ids in failed.items():
+                NotificationOutbox.objects.filter(pk__in=ids).update(last_error=error, claimed_on=None)
+
+
+@celery_app.task()
+def expire_subscriptions():
+    """
+    Deactivates the subscriptions that ended before today. Accounts left without an active
+    subscription are deactivated, their devices lose their subscription start date and the
+    account admin gets one deactivation notification per account.
+    """
+    today = timezone.localdate()
+    now = timezone.now()
+    with transaction.atomic():
+        expired = UserSubscription.objects.filter(is_active=True, user_end_date__lt=today)
+        account_ids = set(expired.values_list('account_id', flat=True))
+        if not account_ids:
+            return
+        expired.filter(account_id__in=account_ids).update(is_active=False, updated_on=now)
+
+        accounts = Account.objects.filter(pk__in=account_ids, is_active=True).without_active_subscription()
+        deactivated = list(accounts.values_list('id', flat=True))
+        Account.objects.filter(pk__in=deactivated).update(is_active=False, updated_on=now)
+        Device.objects.filter(account_id__in=deactivated).update(sub_start_date=None, updated_on=now)
+
+        NotificationOutbox.objects.bulk_enqueue([
+            NotificationOutbox.objects.build(
+                kind='account_status', action='Account Deactivation', to_account_id=account_id, is_active=False)
+            for account_id in deactivated])
+        AccountDropdown.invalidate()
+
+
+@celery_app.on_after_finalize.connect
+def schedule_periodic_tasks(sender, **kwargs):
+    # picks up entries whose on commit dispatch was lost or failed
+    sender.add_periodic_task(60.0, dispatch_notifications.s(), name='dispatch notifications')
+    sender.add_periodic_task(SUBSCRIPTION_SWEEP_INTERVAL, expire_subscriptions.s(), name='expire subscriptions')
@@ -0,0 +1,32 @@
+from factory import DjangoModelFactory, Faker, Sequence, SubFactory
+
+from django_synergy.accounts.models import Account, AssociatedAccounts, AssociatedContacts
+from django_synergy.users.tests.factories import UserFactory
+
+
+class AccountFactory(DjangoModelFactory):
+    account_id = Sequence(lambda n: '{0:08d}'.format(n))
+    account_name = Faker("company")
+    city = Faker("city")
+    account_type = 'hq'
+
+    class Meta:
+        model = Account
+
+
+class AssociatedAccountsFactory(DjangoModelFactory):
+    from_account = SubFactory(AccountFactory)
+    to_account = SubFactory(AccountFactory)
+    accepted = True
+
+    class Meta:
+        model = AssociatedAccounts
+
+
+class AssociatedContactsFactory(DjangoModelFactory):
+    from_user = SubFactory(UserFactory)
+    to_account = SubFactory(AccountFactory)
+    accepted = True
+
+    class Meta:
+        model = AssociatedContacts
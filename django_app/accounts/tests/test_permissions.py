@@ -0,0 +1,50 @@
+import pytest
+
+from django_synergy.accounts import permissions
+from django_synergy.accounts.models import Account
+from django_synergy.accounts.permissions import AccountListScope
+from django_synergy.accounts.tests.factories import AccountFactory, AssociatedAccountsFactory
+from django_synergy.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+LIST_PERMISSIONS = ['account-view-own', 'account-list-subsidiary', 'account-list-hq', 'account-list-associated']
+
+
+@pytest.fixture
+def member(monkeypatch):
+    monkeypatch.setattr(permissions, 'get_user_permission_list', lambda user: LIST_PERMISSIONS)
+    hq = AccountFactory(account_type='hq')
+    account = AccountFactory(parent_account=hq, account_type='sub')
+    AccountFactory.create_batch(2, parent_account=hq, account_type='sub')
+    AccountFactory.create_batch(3, parent_account=account, account_type='sub')
+    return UserFactory(account=account, is_active=True)
+
+
+def union_scope(account):
+    # the per-permission querysets the list used to OR together
+    queryset = Account.objects.filter(pk=account.id) | Account.objects.descendants_of(account) | \
+        Account.objects.filter(parent_account_id=account.parent_account_id)
+    for association in account.from_account.filter(accepted=True):
+        queryset |= Account.objects.filter(pk=association.to_account_id)
+    for association in account.to_account.filter(accepted=True):
+        queryset |= Account.objects.filter(pk=association.from_account_id)
+    return queryset
+
+
+@pytest.mark.parametrize('associations', [0, 10, 500])
+def test_account_list_scope_is_one_query(member, associations, django_assert_num_queries):
+    for index in range(associations):
+        if index % 2:
+            AssociatedAccountsFactory(from_account=member.account)
+        else:
+            AssociatedAccountsFactory(to_account=member.account)
+    AssociatedAccountsFactory(from_account=member.account, accepted=False)
+
+    scope = AccountListScope(member)
+    # the association ids are loaded once and cached
+    scope.predicate()
+    with django_assert_num_queries(1):
+        visible = set(scope.filter(Account.objects.all()).values_list('id', flat=True))
+
+    assert visible == set(union_scope(member.account).values_list('id', flat=True))
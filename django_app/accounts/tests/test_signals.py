@@ -0,0 +1,34 @@
+import pytest
+from django.contrib.auth.models import Group
+
+from django_synergy.accounts.tests.factories import AccountFactory
+from django_synergy.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def admin_group():
+    return Group.objects.create(name='Account Admin')
+
+
+def test_clearing_admin_group_members_refreshes_admins(admin_group):
+    account = AccountFactory()
+    user = UserFactory(account=account, is_active=True)
+    user.groups.add(admin_group)
+    account.refresh_from_db()
+    assert account.admin_id == user.id
+
+    admin_group.user_set.clear()
+    account.refresh_from_db()
+    assert account.admin_id is None
+
+
+def test_removing_admin_group_from_user_refreshes_admin(admin_group):
+    account = AccountFactory()
+    user = UserFactory(account=account, is_active=True)
+    user.groups.add(admin_group)
+
+    user.groups.remove(admin_group)
+    account.refresh_from_db()
+    assert account.admin_id is None
@@ -0,0 +1,116 @@
+import pytest
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django_synergy.accounts.models import Account, AssociatedAccounts
+from django_synergy.accounts.tests.factories import (
+    AccountFactory, AssociatedAccountsFactory, AssociatedContactsFactory)
+from django_synergy.accounts.utils import AccountReachability
+from django_synergy.accounts.views import AccountsViewSet
+from django_synergy.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def superuser():
+    return UserFactory(is_superuser=True, is_active=True)
+
+
+@pytest.fixture
+def hq():
+    return AccountFactory(account_type='hq')
+
+
+def grow(account, subsidiaries, associations):
+    for _ in range(subsidiaries):
+        AccountFactory(parent_account=account, account_type='sub')
+    for _ in range(associations):
+        AssociatedAccountsFactory(from_account=account)
+        AssociatedAccountsFactory(to_account=account)
+
+
+def staff(account, subsidiaries, associations, contacts):
+    grow(account, subsidiaries, associations)
+    associated = AssociatedAccounts.objects.filter(from_account=account).values('to_account')
+    for related in Account.objects.filter(Q(parent_account=account) | Q(pk__in=associated)):
+        UserFactory.create_batch(2, account=related)
+    AssociatedContactsFactory.create_batch(contacts, to_account=account)
+
+
+def get(user, actions, path, status_code=200, meta=None, **kwargs):
+    request = APIRequestFactory().get(path, **(meta or {}))
+    force_authenticate(request, user=user)
+    response = AccountsViewSet.as_view(actions)(request, **kwargs)
+    assert response.status_code == status_code
+    return response
+
+
+def test_account_detail_query_budget(superuser, hq, django_assert_num_queries):
+    grow(hq, subsidiaries=1, associations=1)
+    with CaptureQueriesContext(connection) as baseline:
+        get(superuser, {'get': 'retrieve'}, '/', slug=hq.slug)
+
+    grow(hq, subsidiaries=20, associations=10)
+    with django_assert_num_queries(len(baseline)):
+        get(superuser, {'get': 'retrieve'}, '/', slug=hq.slug)
+
+
+def test_account_detail_without_subsidiaries(superuser, hq):
+    grow(hq, subsidiaries=3, associations=0)
+    response = get(superuser, {'get': 'retrieve'}, '/?expand=', slug=hq.slug)
+    assert response.data['subsidiaries'] is None
+
+
+def test_account_list_query_budget(superuser, hq, django_assert_num_queries):
+    grow(hq, subsidiaries=2, associations=1)
+    with CaptureQueriesContext(connection) as baseline:
+        get(superuser, {'get': 'list'}, '/')
+
+    grow(hq, subsidiaries=20, associations=10)
+    for parent in list(hq.subsidiaries.all()[:5]):
+        grow(parent, subsidiaries=2, associations=0)
+    with django_assert_num_queries(len(baseline)):
+        get(superuser, {'get': 'list'}, '/')
+
+
+def test_case_user_list_query_budget(superuser, hq, django_assert_num_queries):
+    staff(hq, subsidiaries=1, associations=1, contacts=1)
+    with CaptureQueriesContext(connection) as baseline:
+        get(superuser, {'get': 'case_user_list'}, '/', slug=hq.slug)
+
+    staff(hq, subsidiaries=10, associations=5, contacts=5)
+    with django_assert_num_queries(len(baseline)):
+        response = get(superuser, {'get': 'case_user_list'}, '/', slug=hq.slug)
+    assert len(response.data['data']) == AccountReachability(hq).users().count()
+
+
+def test_reachable_users_single_query(hq, django_assert_num_queries):
+    staff(hq, subsidiaries=3, associations=2, contacts=2)
+    with django_assert_num_queries(1):
+        list(AccountReachability(hq).users())
+
+
+def test_list_accounts_not_modified_on_matching_etag(superuser, hq):
+    etag = get(superuser, {'get': 'list_accounts'}, '/')['ETag']
+    get(superuser, {'get': 'list_accounts'}, '/', status_code=304, meta={'HTTP_IF_NONE_MATCH': etag})
+    get(superuser, {'get': 'list_accounts'}, '/', status_code=304, meta={'HTTP_IF_NONE_MATCH': '"other", ' + etag})
+    get(superuser, {'get': 'list_accounts'}, '/', status_code=304, meta={'HTTP_IF_NONE_MATCH': '*'})
+
+
+def test_list_accounts_renders_on_mismatched_etag(superuser, hq):
+    etag = get(superuser, {'get': 'list_accounts'}, '/')['ETag']
+    for if_none_match in (etag[:-2] + '"', '"' + etag[1:4] + '"', 'W/' + etag[:-2] + '"'):
+        response = get(superuser, {'get': 'list_accounts'}, '/', meta={'HTTP_IF_NONE_MATCH': if_none_match})
+        assert response['ETag'] == etag
+
+
+def test_account_search_is_one_query(superuser, hq, django_assert_num_queries):
+    grow(hq, subsidiaries=5, associations=2)
+    AccountFactory(account_name='Northwind Traders')
+    with django_assert_num_queries(1) as captured:
+        response = get(superuser, {'get': 'search'}, '/?q=northwind')
+    assert [account['account_name'] for account in response.data['results']] == ['Northwind Traders']
+    assert 'subscription' not in captured.captured_queries[0]['sql']
@@ -0,0 +1,116 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from rest_framework.renderers import JSONRenderer
+
+from django_synergy.users.models import User
+
+from .models import Account, AccountHierarchy, AssociatedAccounts, AssociatedContacts
+
+ACCOUNT_DROPDOWN_VERSION_KEY = 'account-dropdown-version'
+ACCOUNT_DROPDOWN_CACHE_KEY = 'account-dropdown-{0}-{1}'
+ACCOUNT_ADMIN_CACHE_KEY = 'account-dropdown-admin-{0}'
+
+
+class AccountReachability(object):
+    """
+    Resolves the users that can be picked for work on an account's cases: the users of the
+    account and its subtree, of its HQ and of accounts with an accepted association to it, plus
+    its accepted contacts. Each source is an EXISTS subquery so the result is a single query.
+    """
+
+    def __init__(self, account):
+        self.account = account
+
+    def users(self):
+        in_subtree = AccountHierarchy.objects.filter(ancestor=self.account, descendant=OuterRef('account_id'))
+        in_association = AssociatedAccounts.objects.filter(accepted=True).filter(
+            Q(from_account=self.account, to_account=OuterRef('account_id')) |
+            Q(to_account=self.account, from_account=OuterRef('account_id')))
+        is_contact = AssociatedContacts.objects.filter(accepted=True, to_account=self.account, from_user=OuterRef('pk'))
+
+        reachable = Q(in_subtree=True) | Q(in_association=True) | Q(is_contact=True)
+        if self.account.parent_account_id is not None:
+            reachable |= Q(account_id=self.account.parent_account_id)
+
+        return User.objects.annotate(
+            in_subtree=Exists(in_subtree), in_association=Exists(in_association), is_contact=Exists(is_contact)
+        ).filter(reachable)
+
+
+class AccountDropdown(object):
+    """
+    The account dropdown of a user, rendered once per permission scope and kept in the cache as
+    JSON bytes. Entries are keyed by a version that every account change bumps, the same value
+    serves as the ETag so an unchanged list is answered from the cache alone.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @property
+    def scope(self):
+        if self.user.is_superuser or self.user.is_circadianceadmin:
+            return 'all'
+        elif self.is_account_admin():
+            return 'subtree-{0}'.format(self.user.account_id)
+        return 'account-{0}'.format(self.user.account_id)
+
+    @property
+    def etag(self):
+        return '"{0}-{1}"'.format(self.scope, self.version())
+
+    def is_account_admin(self):
+        key = ACCOUNT_ADMIN_CACHE_KEY.format(self.user.pk)
+        is_account_admin = cache.get(key)
+        if is_account_admin is None:
+            is_account_admin = self.user.groups.filter(name='Account Admin').exists()
+            cache.set(key, is_account_admin, None)
+        return is_account_admin
+
+    def queryset(self):
+        if self.user.is_superuser or self.user.is_circadianceadmin:
+            return Account.objects.all()
+        elif self.is_account_admin():
+            return Account.objects.descendants_of(self.user.account_id, include_self=True)
+        return Account.objects.filter(pk=self.user.account_id)
+
+    def render(self, serializer_class):
+        """
+        Returns the response body for the user's scope, rendering and caching it on a miss.
+        """
+        # read the version first, a change committed meanwhile leaves the entry under a stale key
+        key = ACCOUNT_DROPDOWN_CACHE_KEY.format(self.scope, self.version())
+        content = cache.get(key)
+        if content is None:
+            serializer = serializer_class(self.queryset().order_by('account_name', 'id'), many=True)
+            content = JSONRenderer().render({"success": True, "results": serializer.data, "status_code": 200,
+                                             "message": "List of Accounts"})
+            cache.set(key, content, None)
+        return content
+
+    @staticmethod
+    def version():
+        version = cache.get(ACCOUNT_DROPDOWN_VERSION_KEY)
+        if version is None:
+            # seeded from the clock so a lost counter does not come back to an old value
+            cache.add(ACCOUNT_DROPDOWN_VERSION_KEY, int(time.time()), None)
+            version = cache.get(ACCOUNT_DROPDOWN_VERSION_KEY)
+        return version
+
+    @staticmethod
+    def invalidate():
+        """
+        Drops every cached dropdown once the current transaction commits. Called by the Account
+        signals, and directly by code that changes accounts with update() or bulk_create().
+        """
+        def bump():
+            if not cache.add(ACCOUNT_DROPDOWN_VERSION_KEY, int(time.time()), None):
+                cache.incr(ACCOUNT_DROPDOWN_VERSION_KEY)
+        transaction.on_commit(bump)
+
+    @staticmethod
+    def forget_admin(user_ids):
+        cache.delete_many([ACCOUNT_ADMIN_CACHE_KEY.format(user_id) for user_id in user_ids])
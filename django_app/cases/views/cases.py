@@ -16,8 +16,8 @@ from django_synergy.cases.serializers import CaseSerializer, CaseWritableSeriali
     CaseDetailSerializer, SimpleCaseSerializer, CaseDeviceSerializer, CaseStatusSerializer
 from django_synergy.devices.models import Device, DeviceSettings
 from django_synergy.devices.serializers import DeviceSettingsSerializer
-from django_synergy.notifications.utils import generate_case_notification, \
-    generate_case_user_notification
+from django_synergy.accounts.exports import ExportMixin
+from django_synergy.accounts.models import NotificationOutbox
 from django_synergy.utils.permissions import get_user_permission_list
 
 from django_synergy.utils.views import BaseViewset
@@ -27,9 +27,23 @@ from django_synergy.cases.permissions import CanViewCaseList, user_has_permissio
 logger = logging.getLogger(__name__)
 
 
-class CaseViewSet(BaseViewset):
+class CaseViewSet(ExportMixin, BaseViewset):
     queryset = Case.objects.all()
     lookup_field = 'slug'
+    export_filename = 'cases'
+    export_related = ('account',)
+    # patient details are encrypted and stay out of exports
+    export_columns = (
+        ('Case Number', 'case_no'),
+        ('Account Number', 'account.account_id'),
+        ('Account Name', 'account.account_name'),
+        ('Active', 'is_active'),
+        ('Consent', 'is_consent'),
+        ('Closed', 'is_closed'),
+        ('Archived', 'is_archived'),
+        ('Timezone', 'timezone'),
+        ('Created On', 'created_on'),
+    )
     action_serializers = {
         'default': CaseSerializer,
         'create': CaseWritableSerializer,
@@ -261,6 +275,7 @@ class CaseViewSet(BaseViewset):
                             , status=status.HTTP_400_BAD_REQUEST)
 
     @action(["post"], detail=False)
+    @transaction.atomic
     def archive(self, request, *args, **kwargs):
         try:
             data = request.data
@@ -270,7 +285,8 @@ class CaseViewSet(BaseViewset):
                     case.is_archived = True
                     case.save()
 
-                    generate_case_user_notification.delay(
+                    NotificationOutbox.objects.enqueue(
+                        kind='case_user',
                         action='Case Archived', to_user_id=case.account.account_admin_id, from_user_id=request.user.id,
                         case_number=case.case_no, from_user_name=request.user.first_name + " " + request.user.last_name
                     )
@@ -279,10 +295,12 @@ class CaseViewSet(BaseViewset):
                             , status=status.HTTP_200_OK)
 
         except Exception as e:
-            return Response({"status": "failed", "message": e}
+            transaction.set_rollback(True)
+            return Response({"status": "failed", "message": str(e)}
                             , status=status.HTTP_400_BAD_REQUEST)
 
     @action(["patch"], detail=True)
+    @transaction.atomic
     def edit(self, request, *args, **kwargs):
         try:
             self.check_object_permissions(request, self.get_object())
@@ -293,8 +311,8 @@ class CaseViewSet(BaseViewset):
 
                 context_data = {'link_name': case.case_no, 'case_slug': case.slug}
 
-                generate_case_notification.delay(
-                    action='Case Opened', from_user_id=request.user.id, case_slug=case.slug,
+                NotificationOutbox.objects.enqueue(
+                    kind='case', action='Case Opened', from_user_id=request.user.id, case_slug=case.slug,
                     case_number=case.case_no, case_manager=request.user.name,
                     case_manager_phone_number=request.user.phone1,
                     link=case.slug, context_data=context_data
@@ -304,8 +322,8 @@ class CaseViewSet(BaseViewset):
                 case.is_active = False
                 case.is_closed = True
 
-                generate_case_notification.delay(
-                    action='Case Closed', from_user_id=request.user.id, case_slug=case.slug,
+                NotificationOutbox.objects.enqueue(
+                    kind='case', action='Case Closed', from_user_id=request.user.id, case_slug=case.slug,
                     case_number=case.case_no, case_manager=request.user.name,
                     case_manager_phone_number=request.user.phone1
                 )
@@ -319,10 +337,12 @@ class CaseViewSet(BaseViewset):
                                   "data": CaseSerializer(case, many=False).data})
 
         except Exception as e:
-            return Response({"status": "failed", "message": e}
+            transaction.set_rollback(True)
+            return Response({"status": "failed", "message": str(e)}
                             , status=status.HTTP_400_BAD_REQUEST)
 
     @action(["patch"], detail=True)
+    @transaction.atomic
     def close(self, request, *args, **kwargs):
         self.check_object_permissions(request, self.get_object())
         data = request.data
@@ -334,8 +354,8 @@ class CaseViewSet(BaseViewset):
         device.status = "In Checkout"
         device.save()
 
-        generate_case_notification.delay(
-            action='Case Closed', from_user_id=request.user.id, case_slug=case.slug,
+        NotificationOutbox.objects.enqueue(
+            kind='case', action='Case Closed', from_user_id=request.user.id, case_slug=case.slug,
             case_number=case.case_no, case_manager=request.user.name,
             case_manager_phone_number=request.user.phone1
         )
@@ -380,5 +400,6 @@ class CaseViewSet(BaseViewset):
                             , status=status.HTTP_200_OK)
 
         except Exception as e:
-            return Response({"status": "failed", "message": e}
+            transaction.set_rollback(True)
+            return Response({"status": "failed", "message": str(e)}
                             , status=status.HTTP_400_BAD_REQUEST)
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import Group
+from django.db import transaction
 from rest_framework import status
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from rest_framework.permissions import IsAuthenticated
@@ -11,7 +12,7 @@ from django_synergy.cases.views.utils import save_roles
 from django_synergy.utils.views import BaseViewset
 from django_synergy.cases.permissions import user_has_permission, get_user_permission_list, CanViewCaseRole, \
     CanEditCaseRole
-from django_synergy.notifications.utils import generate_case_user_notification
+from django_synergy.accounts.models import NotificationOutbox
 
 
 class CaseDefaultRoleViewSet(BaseViewset):
@@ -86,8 +87,8 @@ def remove_users(self, removed_users, case, default_role, request):
             # unassigned notification
             to_user = removed_user["user"]
             role_name = default_role.name
-            generate_case_user_notification.delay(
-                action='Case Role Unassigned', to_user_id=to_user.id, from_user_id=request.user.id,
+            NotificationOutbox.objects.enqueue(
+                kind='case_user', action='Case Role Unassigned', to_user_id=to_user.id, from_user_id=request.user.id,
                 case_number=case.case_no, case_manager=request.user.name, case_manager_phone_number=request.user.phone1,
                 role_name=role_name
             )
@@ -97,8 +98,8 @@ def send_assigned_notification(user, default_role, case, request):
     to_user = user
     role_name = default_role.name
     context_data = {'link_name': case.case_no, 'case_slug': case.slug}
-    generate_case_user_notification.delay(
-        action='Case Role Assigned', to_user_id=to_user.id, from_user_id=request.user.id,
+    NotificationOutbox.objects.enqueue(
+        kind='case_user', action='Case Role Assigned', to_user_id=to_user.id, from_user_id=request.user.id,
         case_number=case.case_no, case_manager=request.user.name, case_manager_phone_number=request.user.phone1,
         role_name=role_name, link=case.slug, context_data=context_data
     )
@@ -197,6 +198,7 @@ class CaseRoleViewSet(BaseViewset):
             return Response({"status": "failed", "message": e}
                             , status=status.HTTP_400_BAD_REQUEST)
 
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         try:
             data = request.data
@@ -317,5 +319,6 @@ class CaseRoleViewSet(BaseViewset):
             raise PermissionDenied
 
         except Exception as e:
-            return Response({"status": "failed", "message": e}
+            transaction.set_rollback(True)
+            return Response({"status": "failed", "message": str(e)}
                             , status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,262 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import ParseError, ValidationError
+
+from django_synergy.accounts.importers import read_rows, has_errors
+from django_synergy.accounts.models import Account, UserSubscription
+from django_synergy.accounts.slugs import assign_slugs
+
+from .models import DEVICE_STATUS, Device, DeviceItem, DeviceUploadItems
+from .serializers import DeviceBulkCreateSerializer
+
+# key: internal column
+# value: external the column file uses
+DEVICE_IMPORT_DICTIONARY = {
+    "serial_number": "serial_number",
+    "item_number": "item_number",
+    "date_added": "date_added",
+    "status": "status",
+    # "firmware_revision": "firmware_revision",
+    "account_number": "account_number",
+    "sub_start_date": "sub_start_date",
+}
+
+DEVICE_UPLOAD_ITEM_FIELDS = (
+    "serial_number", "date_added", "status", "account_number", "sub_start_date", "item_number",
+)
+
+DEVICE_STATUS_CODES = frozenset(code for code, label in DEVICE_STATUS)
+
+
+def try_parsing_date(text):
+    for fmt in ('%d-%b-%Y', '%d-%b-%y'):
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError('no valid date format found')
+
+
+class DeviceImporter(object):
+    """
+    Validates a device upload and stores the rows as DeviceUploadItems, writing them in chunks
+    and recording progress on the upload after every chunk. The serial numbers, accounts and
+    items a chunk refers to are looked up with one IN query each and rows are checked against
+    those sets.
+    """
+    chunk_size = 1000
+
+    def __init__(self, device_upload):
+        self.device_upload = device_upload
+        self.device_upload_id = device_upload.id
+        self.processed_rows = 0
+        self.error_rows = 0
+        self.serial_numbers = set()
+        self.existing_serial_numbers = set()
+        self.existing_accounts = set()
+        self.existing_items = set()
+
+    def run(self, file, filename):
+        try:
+            chunk = []
+            for row in read_rows(file, filename, list(DEVICE_IMPORT_DICTIONARY.keys())):
+                chunk.append(row)
+                if len(chunk) == self.chunk_size:
+                    self.process_chunk(chunk)
+                    chunk = []
+            self.process_chunk(chunk)
+
+        except Exception as e:
+            self.discard()
+            raise ParseError(detail=str(e))
+
+    def process_chunk(self, rows):
+        self.preload(rows)
+        items = [self.build_item(self.parse_data(row)) for row in rows]
+        DeviceUploadItems.objects.bulk_create(items, batch_size=self.chunk_size)
+        self.processed_rows += len(rows)
+        self.error_rows += sum(1 for item in items if has_errors(item.errors))
+        self.device_upload.report_progress(self.processed_rows, self.error_rows)
+
+    def preload(self, rows):
+        def referenced(column):
+            return set(str(row[column]) for row in rows if row[column] not in (None, ''))
+
+        self.existing_serial_numbers = set(Device.objects.filter(
+            serial_number__in=referenced('serial_number')).values_list('serial_number', flat=True))
+        self.existing_accounts = set(Account.objects.filter(
+            account_id__in=referenced('account_number')).values_list('account_id', flat=True))
+        self.existing_items = set(DeviceItem.objects.filter(
+            item_number__in=referenced('item_number')).values_list('item_number', flat=True))
+
+    def discard(self):
+        DeviceUploadItems.objects.filter(device_upload_id=self.device_upload_id).delete()
+
+    def build_item(self, row):
+        item = DeviceUploadItems(device_upload_id=self.device_upload_id, errors=row["errors"])
+        for field_name in DEVICE_UPLOAD_ITEM_FIELDS:
+            value = row.get(field_name)
+            field = DeviceUploadItems._meta.get_field(field_name)
+            if field.get_internal_type() == 'CharField' and value is not None:
+                value = str(value)
+                if len(value) > field.max_length:
+                    value = value[:field.max_length]
+                    item.errors['value_too_long'] = True
+                    item.errors['error_detail'].append(
+                        "{0} cannot be longer than {1} characters".format(field_name, field.max_length))
+            elif field.get_internal_type() == 'DateField' and not isinstance(value, datetime.date):
+                if value not in (None, ''):
+                    item.errors['data_missing'] = True
+                    item.errors['error_detail'].append("Unable to parse {0}".format(field_name))
+                value = None
+            setattr(item, field_name, value)
+        return item
+
+    def parse_data(self, row):
+        row_errors = {'error_detail': list()}
+        if row['serial_number'] is None or row['serial_number'] == '':
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("Serial number missing")
+        else:
+            if str(row['serial_number']) in self.existing_serial_numbers:
+                row_errors['serial_exists'] = True
+                row_errors['error_detail'].append("Device with this serial number already exists")
+            elif str(row['serial_number']) in self.serial_numbers:
+                row_errors['dublicate_entry'] = True
+                row_errors['error_detail'].append("Duplicate entry")
+            elif len(str(row['serial_number'])) > 10:
+                row_errors["data_missing"] = True
+                row_errors['error_detail'].append("Serial number cannot be greater than 10 characters")
+            else:
+                self.serial_numbers.add(str(row['serial_number']))
+
+        # item_number
+        if row['item_number'] is None or row['item_number'] == '':
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("Item number missing")
+        else:
+            if str(row['item_number']) not in self.existing_items:
+                row_errors['item_number_not_exists'] = True
+                row_errors['error_detail'].append("Item number does not exist")
+            elif len(str(row['item_number'])) > 10:
+                row_errors['error_detail'].append("Item number cannot be greater than 10 characters")
+
+        # date_added
+        if row['date_added'] is None or row['date_added'] == '':
+
+            row['date_added'] = timezone.now().date()
+        else:
+            if not type(row['date_added']) == datetime.date:
+                try:
+                    row['date_added'] = try_parsing_date(row['date_added']).date()
+                except Exception:
+                    row['date_added'] = None
+                    row_errors["data_missing"] = True
+                    row_errors['error_detail'].append("Unable to parse date added")
+
+        # status
+        if row['status'] is None or row['status'] == '':
+            row['status'] = 'Available'
+        else:
+            if row['status'] not in DEVICE_STATUS_CODES:
+                row_errors['data_missing'] = True
+                row_errors['error_detail'].append("Incorrect Status")
+
+        # account
+        if row['account_number'] is None or row['account_number'] == '':
+            row_errors['data_missing'] = True
+            row_errors['error_detail'].append("Account number missing")
+        else:
+            if str(row['account_number']) not in self.existing_accounts:
+                row_errors['account_not_exist'] = True
+                row_errors['error_detail'].append("Account with this account number does not exist")
+
+        # sub_start_date
+        if row['sub_start_date'] is None or row['sub_start_date'] == '':
+            row['sub_start_date'] = None
+        else:
+            if not type(row['sub_start_date']) == datetime.date:
+                try:
+                    row['sub_start_date'] = try_parsing_date(row['sub_start_date']).date()
+                except Exception as e:
+                    row['sub_start_date'] = None
+                    row_errors["data_missing"] = True
+                    row_errors['error_detail'].append("Unable to parse subscription start date")
+
+        row["errors"] = row_errors
+        return row
+
+
+class DeviceBulkCreator(object):
+    """
+    Creates the devices of a bulk create request with a fixed number of queries: accounts, items
+    and taken serial numbers are resolved once for the whole batch, slugs are allocated together
+    and the devices are inserted in chunks. Nothing is inserted when a row fails, the errors are
+    raised as one ValidationError listing the errors of every row by position.
+    """
+    chunk_size = 1000
+
+    def __init__(self, records, user=None):
+        self.records = records
+        self.user = user
+
+    def run(self):
+        rows, errors = self.validate()
+        if any(errors):
+            raise ValidationError(errors)
+
+        devices = [self.build_device(row) for row in rows]
+        assign_slugs(devices)
+        with transaction.atomic():
+            Device.objects.bulk_create(devices, batch_size=self.chunk_size)
+        return devices
+
+    def validate(self):
+        rows, errors = [], []
+        for record in self.records:
+            serializer = DeviceBulkCreateSerializer(data=record)
+            if serializer.is_valid():
+                rows.append(dict(serializer.validated_data))
+                errors.append({})
+            else:
+                rows.append(None)
+                errors.append(dict(serializer.errors))
+
+        valid_rows = [row for row in rows if row is not None]
+        self.accounts = Account.objects.annotate(has_active_subscription=Exists(UserSubscription.objects.filter(
+            account=OuterRef('pk'), is_active=True, is_cancelled=False))).in_bulk(
+            set(row['account'] for row in valid_rows), field_name='account_id')
+        self.items = DeviceItem.objects.in_bulk(
+            set(row['item'] for row in valid_rows if row.get('item')), field_name='slug')
+        taken = set(Device.objects.filter(
+            serial_number__in=set(row['serial_number'] for row in valid_rows)).values_list('serial_number', flat=True))
+
+        seen = set()
+        for row, row_errors in zip(rows, errors):
+            if row is None:
+                continue
+            if row['serial_number'] in taken:
+                row_errors['serial_number'] = ["Device with this serial number already exists"]
+            elif row['serial_number'] in seen:
+                row_errors['serial_number'] = ["Duplicate entry"]
+            seen.add(row['serial_number'])
+            if row['account'] not in self.accounts:
+                row_errors['account'] = ["Account with this account number does not exist"]
+            if row.get('item') and row['item'] not in self.items:
+                row_errors['item'] = ["Item does not exist"]
+        return rows, errors
+
+    def build_device(self, row):
+        account = self.accounts[row['account']]
+        device = Device(serial_number=row['serial_number'], date_added=row['date_added'], account=account,
+                        item=self.items.get(row.get('item')), sub_start_date=row.get('sub_start_date'))
+        if row.get('status'):
+            device.status = row['status']
+        if account.has_active_subscription and device.sub_start_date is None:
+            device.sub_start_date = timezone.now().date()
+        if self.user is not None:
+            device.created_by = device.updated_by = self.user
+        return device
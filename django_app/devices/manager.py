@@ -0,0 +1,24 @@
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+from django.db.models import DateField, F, Func, OuterRef, Subquery
+
+from django_synergy.accounts.models import UserSubscription
+
+
+class DeviceQuerySet(models.QuerySet):
+
+    def with_subscription_window(self):
+        """
+        Annotates the start and end date of the owning account's latest active subscription, read
+        by Device.subscription_start_date and Device.sub_end_date instead of two queries per device.
+        Both dates come from one correlated subquery as a two element array.
+        """
+        subscription = UserSubscription.objects.filter(
+            account=OuterRef('account_id'), is_active=True).order_by('-created_on').annotate(
+            window=Func(F('user_start_date'), F('user_end_date'), function='ARRAY',
+                        template='%(function)s[%(expressions)s]', output_field=ArrayField(DateField())))
+        return self.annotate(annotated_subscription_window=Subquery(subscription.values('window')[:1]))
+
+
+class DeviceManager(models.Manager.from_queryset(DeviceQuerySet)):
+    pass
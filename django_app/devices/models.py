@@ -11,7 +11,8 @@ from django_extensions.db.fields import AutoSlugField
 
 from django_synergy.devices.utils import *
 from django_synergy.utils.models import AbstractBaseModel
-from django_synergy.accounts.models import Account
+from django_synergy.accounts.models import Account, AbstractImportJob
+from .manager import DeviceManager
 from django_synergy.events.utils.constants import IDS_SMQEV_MEMFULLWARNING, IDS_SMQEV_MEMFULL, IDS_SMQEV_LOWBAT1, \
     IDS_SMQEV_LOWBAT2, IDS_SMQEV_RESPLOOSE, IDS_SMQEV_OXLOOSE, IDS_SMQEV_XTALARM2, IDS_SMQEV_PWRUP, IDS_SMQEV_KEYBDMODE, \
     IDS_SMQEV_PARMCHG, IDS_SMQEV_OXON, IDS_SMQEV_TIMEDATE, IDS_SMQEV_EVENTDLOAD, IDS_SMQEV_EVENTCLEAR, \
@@ -184,17 +185,33 @@ class Device(AbstractBaseModel):
     settings = models.ManyToManyField(DeviceSettings, through='DeviceSettingHistory', related_name='device_settings',
                                       blank=True, symmetrical=False)
 
+    objects = DeviceManager()
+
     def __str__(self):
         return self.serial_number
 
+    @property
+    def subscription_start_date(self):
+        # populated by Device.objects.with_subscription_window()
+        if hasattr(self, 'annotated_subscription_window'):
+            return self.annotated_subscription_window[0] if self.annotated_subscription_window else None
+        subscription = self.account.user_subscriptions.filter(is_active=True).order_by('-created_on').first()
+        return subscription.user_start_date if subscription is not None else None
+
     @property
     def sub_end_date(self):
-        if len(self.account.user_subscriptions.filter(is_active=True).all()) > 0:
-            return self.account.user_subscriptions.order_by('-created_on')[0].user_end_date
-        else:
-            return None
+        # populated by Device.objects.with_subscription_window()
+        if hasattr(self, 'annotated_subscription_window'):
+            return self.annotated_subscription_window[1] if self.annotated_subscription_window else None
+        subscription = self.account.user_subscriptions.filter(is_active=True).order_by('-created_on').first()
+        return subscription.user_end_date if subscription is not None else None
 
     class Meta:
+        indexes = [
+            models.Index(name='device_account_status', fields=['account', 'status']),
+            models.Index(name='device_account_created', fields=['account', 'created_on', 'id']),
+            models.Index(name='device_created', fields=['created_on', 'id']),
+        ]
         default_permissions = ()
         permissions = [
             ("device-list-account", _("Can view list of account devices")),
@@ -271,7 +288,7 @@ def validate_upload(value):
 #                          populate_from='id', slugify_function=slugify)
 
 
-class DeviceUpload(AbstractBaseModel):
+class DeviceUpload(AbstractBaseModel, AbstractImportJob):
     _key_prefix = settings.DEVICE_IMPORT_KEY_PREFIX
 
     upload = models.FileField(
@@ -299,6 +316,18 @@ class EquipmentMaintenanceRecord(AbstractBaseModel):
                          populate_from='device__serial_number', slugify_function=slugify)
 
 
+class DeviceTransfer(models.Model):
+    # Audit trail of devices moved between accounts, written in bulk by transfer_devices
+    device = models.ForeignKey(Device, on_delete=models.PROTECT, related_name='transfers')
+    from_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='+')
+    to_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='+')
+    transferred_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    transferred_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        default_permissions = ()
+
+
 class EquipmentEvent(AbstractBaseModel):
     slug = models.CharField(max_length=255, unique=True, db_index=True)
     case = models.ForeignKey('cases.Case', related_name="case_equipment_events", on_delete=models.PROTECT)
@@ -0,0 +1,70 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class DevicePagination(CursorPagination):
+    """
+    Keyset pagination on (created_on, id), newest first. The cursor of DRF only keeps the first
+    ordering field and an offset into its ties, here it carries both values of the boundary row
+    and a page starts after it: created_on < c OR (created_on = c AND id < i). The device indexes
+    on (created_on, id) serve that predicate so deep pages cost the same as the first.
+    """
+    ordering = ('-created_on', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        boundary = None
+        if self.cursor is not None and self.cursor.position is not None:
+            boundary = self.decode_position(self.cursor.position)
+
+        # previous pages are read oldest first from the boundary and flipped back
+        queryset = queryset.order_by('created_on', 'id') if reverse else queryset.order_by(*self.ordering)
+        if boundary is not None:
+            created_on, pk = boundary
+            lookup = 'gt' if reverse else 'lt'
+            queryset = queryset.filter(Q(**{'created_on__' + lookup: created_on}) |
+                                       Q(created_on=created_on, **{'id__' + lookup: pk}))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+        self.has_next = boundary is not None if reverse else has_more
+        self.has_previous = has_more if reverse else boundary is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0])))
+
+    @staticmethod
+    def encode_position(device):
+        return '{0}|{1}'.format(device.created_on.isoformat(), device.id)
+
+    def decode_position(self, position):
+        try:
+            created_on, pk = position.split('|', 1)
+            created_on = parse_datetime(created_on)
+            if created_on is None:
+                raise ValueError(position)
+            return [created_on, int(pk)]
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
@@ -57,13 +57,7 @@ class CanViewDeviceDetail(permissions.IsAuthenticated):
 
         elif user_has_permission('device-view-detail-assc', user_permissions):
 
-            associated_to_accounts = [ass_acc.to_account for ass_acc in user.account.from_account.filter(accepted=True)]
-            associated_from_accounts = [ass_acc.from_account for ass_acc in
-                                        user.account.to_account.filter(accepted=True)]
-            associated_accounts = associated_to_accounts + associated_from_accounts
-            associated_accounts_ids = [asc.id for asc in associated_accounts]
-
-            if obj.account.id in associated_accounts_ids:
+            if obj.account_id in user.account.associated_ids():
                 return True
         elif user_has_permission('device-view-detail-assigned', user_permissions):
             user_cases = [cr.case for cr in user.case_role_user.all() if (cr.case.is_active is True and cr.case.is_archived is False)]
@@ -132,12 +126,7 @@ class CanViewDeviceSetting(permissions.IsAuthenticated):
         elif obj.device.account == user.account.parent_account and user_has_permission('device-view-settings-hq', user_permissions):
             return True
         elif user_has_permission('device-view-settings-assc', user_permissions):
-            associated_to_accounts = [ass_acc.to_account for ass_acc in user.account.from_account.filter(accepted=True)]
-            associated_from_accounts = [ass_acc.from_account for ass_acc in
-                                        user.account.to_account.filter(accepted=True)]
-            associated_accounts = associated_to_accounts + associated_from_accounts
-            associated_accounts_ids = [asc.id for asc in associated_accounts]
-            if obj.device.account.id in associated_accounts_ids:
+            if obj.device.account_id in user.account.associated_ids():
                 return True
         elif user_has_permission('device-view-settings-assigned', user_permissions):
             user_cases = [cr.case for cr in user.case_role_user.all() if (cr.case.is_active is True and cr.case.is_archived is False)]
@@ -178,12 +167,7 @@ class CanViewDeviceSettingHistory(permissions.IsAuthenticated):
         elif obj.device.account == user.account.parent_account and user_has_permission('device-view-settings-history-hq', user_permissions):
             return True
         elif user_has_permission('device-view-settings-history-assc', user_permissions):
-            associated_to_accounts = [ass_acc.to_account for ass_acc in user.account.from_account.filter(accepted=True)]
-            associated_from_accounts = [ass_acc.from_account for ass_acc in
-                                        user.account.to_account.filter(accepted=True)]
-            associated_accounts = associated_to_accounts + associated_from_accounts
-            associated_accounts_ids = [asc.id for asc in associated_accounts]
-            if obj.device.account.id in associated_accounts_ids:
+            if obj.device.account_id in user.account.associated_ids():
                 return True
         elif user_has_permission('device-view-settings-history-assigned', user_permissions):
             user_cases = [cr.case for cr in user.case_role_user.all() if (cr.case.is_active is True and cr.case.is_archived is False)]
@@ -224,12 +208,7 @@ class CanViewEquipmentRecord(permissions.IsAuthenticated):
         elif obj.device.account == user.account.parent_account and user_has_permission('device-view-eqp-record-hq', user_permissions):
             return True
         elif user_has_permission('device-view-settings-history-assc', user_permissions):
-            associated_to_accounts = [ass_acc.to_account for ass_acc in user.account.from_account.filter(accepted=True)]
-            associated_from_accounts = [ass_acc.from_account for ass_acc in
-                                        user.account.to_account.filter(accepted=True)]
-            associated_accounts = associated_to_accounts + associated_from_accounts
-            associated_accounts_ids = [asc.id for asc in associated_accounts]
-            if obj.device.account.id in associated_accounts_ids:
+            if obj.device.account_id in user.account.associated_ids():
                 return True
         elif user_has_permission('device-view-settings-history-assigned', user_permissions):
             user_cases = [cr.case for cr in user.case_role_user.all() if (cr.case.is_active is True and cr.case.is_archived is False)]
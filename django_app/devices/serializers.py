@@ -6,7 +6,7 @@ from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from .models import Device, DeviceItem, DeviceUpload, DeviceUploadItems, DeviceSettings, EquipmentMaintenanceRecord, \
-    DeviceSettingHistory, EquipmentEvent, EQUIPMENT_EVENT_CODES
+    DeviceSettingHistory, EquipmentEvent, EQUIPMENT_EVENT_CODES, DEVICE_STATUS
 from django_synergy.utils.serializers import BaseSerializer
 from ..accounts.models import Account
 from datetime import datetime
@@ -17,7 +17,8 @@ from ..cases.models import Case
 class DeviceSerializer(BaseSerializer):
     account = serializers.SerializerMethodField()
     item = serializers.SerializerMethodField()
-    sub_end_date = serializers.DateField()
+    sub_end_date = serializers.DateField(read_only=True)
+    subscription_start_date = serializers.DateField(read_only=True)
 
     def get_item(self, obj):
         return {
@@ -95,6 +96,19 @@ class DeviceCreateSerializer(BaseSerializer):
         )
 
 
+class DeviceBulkCreateSerializer(serializers.Serializer):
+    """
+    Field validation of one device of a bulk create, references are resolved for the whole batch
+    by DeviceBulkCreator.
+    """
+    serial_number = serializers.CharField(max_length=10)
+    item = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    date_added = serializers.DateField()
+    status = serializers.ChoiceField(choices=DEVICE_STATUS, required=False)
+    account = serializers.CharField()
+    sub_start_date = serializers.DateField(required=False, allow_null=True)
+
+
 class DeviceWritableSerializer(BaseSerializer):
     class Meta:
         model = Device
@@ -169,6 +183,7 @@ class DeviceUploadSerializer(BaseSerializer):
             "upload",
             "slug",
             'id',
+            "status",
             "items"
         )
 
@@ -183,6 +198,25 @@ class DeviceUploadWritableSerializer(BaseSerializer):
         )
 
 
+class DeviceUploadProgressSerializer(BaseSerializer):
+    eta = serializers.ReadOnlyField()
+
+    class Meta:
+        model = DeviceUpload
+        lookup_field = 'slug'
+        fields = (
+            'id',
+            "status",
+            "total_rows",
+            "processed_rows",
+            "error_rows",
+            "eta",
+            "started_on",
+            "finished_on",
+            "failure_message",
+        )
+
+
 class DeviceSettingsSerializer(BaseSerializer):
     class Meta:
         model = DeviceSettings
@@ -0,0 +1,24 @@
+from rest_framework.exceptions import ParseError
+
+from config import celery_app
+
+from django_synergy.accounts.importers import count_rows
+
+from .importers import DeviceImporter
+from .models import DeviceUpload
+
+
+@celery_app.task()
+def import_device_upload(device_upload_id):
+    device_upload = DeviceUpload.objects.get(pk=device_upload_id)
+    try:
+        with device_upload.upload.open('rb') as file:
+            device_upload.start(count_rows(file, device_upload.upload.name))
+            DeviceImporter(device_upload).run(file, device_upload.upload.name)
+    except ParseError as e:
+        device_upload.fail(str(e.detail))
+        return
+    except Exception as e:
+        device_upload.fail(str(e))
+        raise
+    device_upload.complete()
@@ -1,58 +1,36 @@
-import os
 from io import TextIOWrapper
-from tempfile import mkstemp
-import datetime
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 
+from django.db import transaction
 from django.utils import timezone
 
 # from config.settings.base import MEDIA_URL, MEDIA_ROOT
 from django_synergy.utils.views import BaseViewset, isSuperUser
-from .models import DEVICE_STATUS, DeviceSettings, EquipmentMaintenanceRecord, DeviceSettingHistory
+from .models import DeviceSettings, EquipmentMaintenanceRecord, DeviceSettingHistory
 
 from .serializers import DeviceSerializer, DeviceCreateSerializer, DeviceWritableSerializer, DeviceItemSerializer, \
     DeviceUploadSerializer, DeviceUploadWritableSerializer, DeviceUploadItemSerializer, DeviceSettingsSerializer, \
     EquipmentMaintenanceRecordSerializer, EquipmentMaintenanceRecordReadOnlySerializer, DeviceSettingHistorySerializer, \
-    DeviceSettingHistoryWritableSerializer, DeviceReadOnlySerializer
-from .models import Device, DeviceItem, DeviceUpload, DeviceUploadItems
+    DeviceSettingHistoryWritableSerializer, DeviceReadOnlySerializer, DeviceUploadProgressSerializer
+from .models import Device, DeviceItem, DeviceTransfer, DeviceUpload, DeviceUploadItems
 from .permissions import CanViewDeviceList, CanViewDeviceDetail, CanEditDevice, CanViewDeviceSetting, \
     CanViewDeviceSettingHistory, CanViewEquipmentRecord, CanEditEquipmentRecord
 
 from drf_jwt_2fa.authentication import Jwt2faAuthentication
 from rest_framework.response import Response
 from rest_framework import status
-import csv
-from xlrd import open_workbook, xldate_as_tuple
 
-from ..accounts.models import Account
+from .pagination import DevicePagination
+from ..accounts.exports import ExportMixin
+from ..accounts.models import Account, NotificationOutbox
 from django_synergy.users.permissions import isSuperUser
 
-# key: internal column
-# value: external the column file uses
-from ..notifications.utils import generate_user_notification
-from ..users.models import User
 from django_synergy.utils.permissions import get_user_permission_list, user_has_permission
 from rest_framework.permissions import IsAuthenticated
 
-DEVICE_IMPORT_DICTIONARY = {
-    "serial_number": "serial_number",
-    "item_number": "item_number",
-    "date_added": "date_added",
-    "status": "status",
-    # "firmware_revision": "firmware_revision",
-    "account_number": "account_number",
-    "sub_start_date": "sub_start_date",
-}
-
-
-def try_parsing_date(text):
-    for fmt in ('%d-%b-%Y', '%d-%b-%y'):
-        try:
-            return datetime.datetime.strptime(text, fmt)
-        except ValueError:
-            pass
-    raise ValueError('no valid date format found')
+from .importers import DEVICE_IMPORT_DICTIONARY, DeviceBulkCreator
+from .tasks import import_device_upload
 
 
 def map_coloumns(to_be_mapped, DEVICE_IMPORT_DICTIONARY):
@@ -79,17 +57,22 @@ def append_errors(import_device, serial_numbers, result):
         account_id=import_device["account"]).count() == 0 else False
 
 
-def get_slug(id):
-    try:
-        account = Account.objects.get(account_id=id).slug
-        return account
-    except:
-        return ''
-
-
-class DeviceViewSet(BaseViewset):
+class DeviceViewSet(ExportMixin, BaseViewset):
     queryset = Device.objects.all()
     lookup_field = 'slug'
+    pagination_class = DevicePagination
+    export_filename = 'devices'
+    export_related = ('account', 'item')
+    export_columns = (
+        ('Serial Number', 'serial_number'),
+        ('Item Number', 'item.item_number'),
+        ('Status', 'status'),
+        ('Account Number', 'account.account_id'),
+        ('Account Name', 'account.account_name'),
+        ('Date Added', 'date_added'),
+        ('Subscription Start Date', 'sub_start_date'),
+        ('Active', 'is_active'),
+    )
     action_serializers = {
         'default': DeviceSerializer,
         'create': DeviceCreateSerializer,
@@ -100,15 +83,18 @@ class DeviceViewSet(BaseViewset):
 
     @action(["post"], detail=False)
     def bulk_create(self, request, *args, **kwargs):
-        data = request.data
-        for device in data:
-            device['account'] = get_slug(device['account'])
-        serializer = self.get_serializer(data=data, many=True)
-        if serializer.is_valid(raise_exception=True):
-            serializer.save()
-            return Response(status=status.HTTP_200_OK)
+        DeviceBulkCreator(request.data, user=request.user).run()
+        return Response(status=status.HTTP_200_OK)
 
     def get_queryset(self):
+        queryset = self.get_scoped_queryset()
+        if self.action in ('list', 'retrieve'):
+            # everything DeviceSerializer reads, so rows do not query per device
+            queryset = queryset.with_subscription_window().select_related(
+                'account__parent_account', 'item').prefetch_related('settings')
+        return queryset
+
+    def get_scoped_queryset(self):
         user = self.request.user
         devices = Device.objects.none()
 
@@ -124,12 +110,7 @@ class DeviceViewSet(BaseViewset):
                 if user.account.parent_account:
                     devices = devices | Device.objects.filter(account__id=user.account.parent_account.id)
             if user_has_permission('device-list-assc', user_permissions):
-                associated_to_accounts = [ass_acc.to_account for ass_acc in
-                                          user.account.from_account.filter(accepted=True)]
-                associated_from_accounts = [ass_acc.from_account for ass_acc in
-                                            user.account.to_account.filter(accepted=True)]
-                associated_accounts = associated_to_accounts + associated_from_accounts
-                associated_devices = Device.objects.filter(account__in=associated_accounts)
+                associated_devices = Device.objects.filter(account_id__in=user.account.associated_ids())
                 devices = devices | associated_devices
             return devices
 
@@ -218,64 +199,61 @@ class DeviceViewSet(BaseViewset):
         try:
             account_slug = request.query_params.get('account', None)
             account = Account.objects.get(slug=account_slug)
-            device = Device.objects.filter(account=account)
-            device_serializer = DeviceReadOnlySerializer(device, many=True).data
-            return Response(status=status.HTTP_200_OK,
-                            data={"success": True, "data": device_serializer})
+            devices = Device.objects.filter(account=account).select_related('item')
+            page = self.paginate_queryset(devices)
+            return self.get_paginated_response(DeviceReadOnlySerializer(page, many=True).data)
 
         except Exception as e:
             return Response({"status": "failed", "message": e}
                             , status=status.HTTP_400_BAD_REQUEST)
 
     @action(["post"], detail=False, permission_classes=[isSuperUser])
+    @transaction.atomic
     def transfer_devices(self, request, *args, **kwargs):
         try:
             data = request.data
             from_account = Account.objects.get(slug=data["from_account"])
             to_account = Account.objects.get(slug=data["to_account"])
-            devices = Device.objects.filter(slug__in=data["devices"])
-            devices_list = []
-
-            for device in devices:
-                device.account = to_account
-                devices_list.append(str(device.serial_number))
-                device.save()
-
-            serial_numbers = ', '.join(devices_list)
-
-            from_account_users = User.objects.filter(account=from_account)
-            from_account_admin = None
-            for from_account_user in from_account_users:
-                if from_account_user.groups.filter(name='Account Admin').count() > 0:
-                    from_account_admin = from_account_user
-                    break
-
-            to_account_users = User.objects.filter(account=to_account)
-            to_account_admin = None
-            for to_account_user in to_account_users:
-                if to_account_user.groups.filter(name='Account Admin').count() > 0:
-                    to_account_admin = to_account_user
-                    break
+            # devices assigned to a case stay with their account
+            transferable = Device.objects.filter(
+                slug__in=data["devices"], account=from_account).exclude(status='Assigned')
+            devices = list(transferable.select_for_update().values_list('id', 'slug', 'serial_number'))
+            Device.objects.filter(pk__in=[device_id for device_id, slug, serial_number in devices]).update(
+                account=to_account, updated_on=timezone.now(), updated_by=request.user)
+
+            DeviceTransfer.objects.bulk_create([
+                DeviceTransfer(device_id=device_id, from_account=from_account, to_account=to_account,
+                               transferred_by=request.user)
+                for device_id, slug, serial_number in devices], batch_size=1000)
+
+            serial_numbers = ', '.join(str(serial_number) for device_id, slug, serial_number in devices)
+
+            admins = Account.objects.resolve_admins([from_account.id, to_account.id]) if devices else {}
+            from_account_admin = admins.get(from_account.id)
+            to_account_admin = admins.get(to_account.id)
 
             if from_account_admin is not None:
-                generate_user_notification(
+                NotificationOutbox.objects.enqueue(
                     action="Devices Transferred From Account", to_user=from_account_admin, from_user=request.user,
                     from_user_name=request.user.first_name + " " + request.user.last_name,
                     to_account_name=to_account.account_name, from_account_name=from_account.account_name,
                     device_serial_Numbers=serial_numbers)
 
             if to_account_admin is not None:
-                generate_user_notification(
+                NotificationOutbox.objects.enqueue(
                     action="Devices Transferred To Account", to_user=to_account_admin, from_user=request.user,
                     from_user_name=request.user.first_name + " " + request.user.last_name,
                     to_account_name=to_account.account_name, from_account_name=from_account.account_name,
                     device_serial_Numbers=serial_numbers)
 
+            transferred = set(slug for device_id, slug, serial_number in devices)
             return Response(status=status.HTTP_200_OK,
-                            data={"success": True, "message": "Devices transferred successfully"})
+                            data={"success": True, "message": "Devices transferred successfully",
+                                  "skipped": [slug for slug in data["devices"] if slug not in transferred]})
 
         except Exception as e:
-            return Response({"status": "failed", "message": e}
+            transaction.set_rollback(True)
+            return Response({"status": "failed", "message": str(e)}
                             , status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -306,13 +284,8 @@ class EquipmentMaintenanceRecordViewSet(BaseViewset):
                     eqp_records = eqp_records | EquipmentMaintenanceRecord.objects.filter(
                         device__account__id=user.account.parent_account.id)
             if user_has_permission('device-view-eqp-record-assc', user_permissions):
-                associated_to_accounts = [ass_acc.to_account for ass_acc in
-                                          user.account.from_account.filter(accepted=True)]
-                associated_from_accounts = [ass_acc.from_account for ass_acc in
-                                            user.account.to_account.filter(accepted=True)]
-                associated_accounts = associated_to_accounts + associated_from_accounts
                 associated_eqp_records = EquipmentMaintenanceRecord.objects.filter(
-                    device__account__in=associated_accounts)
+                    device__account_id__in=user.account.associated_ids())
                 eqp_records = eqp_records | associated_eqp_records
             return eqp_records
 
@@ -391,146 +364,16 @@ class DeviceUploadViewSet(BaseViewset):
         return context
 
     def create(self, request, *args, **kwargs):
-        file = request.FILES['upload']
-        temp_file, temp_path = mkstemp()
-        with open(temp_path, 'wb') as f:
-            f.write(file.read())
-        filename = file.name
         response = super().create(request, args, kwargs)
         device_upload_id = response.data['data']['id']
-        DeviceUploadItems.objects.filter(is_imported=False).delete()
-        self.parse_file(temp_file, filename, device_upload_id, temp_path)
-        os.close(temp_file)
+        # parsed off-request, poll the progress action with the returned id
+        transaction.on_commit(lambda: import_device_upload.delay(device_upload_id))
         return response
 
-    def parse_data(self, row, serial_numbers, device_upload_id):
-        row_errors = {'error_detail': list()}
-        if row['serial_number'] is None or row['serial_number'] == '':
-            row_errors['data_missing'] = True
-            row_errors['error_detail'].append("Serial number missing")
-        else:
-            if Device.objects.filter(serial_number=row['serial_number']).count() > 0:
-                row_errors['serial_exists'] = True
-                row_errors['error_detail'].append("Device with this serial number already exists")
-            elif row['serial_number'] in serial_numbers:
-                row_errors['dublicate_entry'] = True
-                row_errors['error_detail'].append("Duplicate entry")
-            elif len(str(row['serial_number'])) > 10:
-                row_errors["data_missing"] = True
-                row_errors['error_detail'].append("Serial number cannot be greater than 10 characters")
-            else:
-                serial_numbers.append(row['serial_number'])
-
-        # item_number
-        if row['item_number'] is None or row['item_number'] == '':
-            row_errors['data_missing'] = True
-            row_errors['error_detail'].append("Item number missing")
-        else:
-            if DeviceItem.objects.filter(item_number=row['item_number']).count() == 0:
-                row_errors['item_number_not_exists'] = True
-                row_errors['error_detail'].append("Item number does not exist")
-            elif len(str(row['item_number'])) > 10:
-                row_errors['error_detail'].append("Item number cannot be greater than 10 characters")
-
-        # date_added
-        if row['date_added'] is None or row['date_added'] == '':
-
-            row['date_added'] = timezone.now().date()
-        else:
-            if not type(row['date_added']) == datetime.date:
-                try:
-                    row['date_added'] = try_parsing_date(row['date_added']).date()
-                except Exception:
-                    row['date_added'] = None
-                    row_errors["data_missing"] = True
-                    row_errors['error_detail'].append("Unable to parse date added")
-
-        # status
-        if row['status'] is None or row['status'] == '':
-            row['status'] = 'Available'
-        else:
-            if row['status'] not in [i[0] for i in DEVICE_STATUS]:
-                row_errors['data_missing'] = True
-                row_errors['error_detail'].append("Incorrect Status")
-        # firmware
-        # if row['firmware_revision'] is None or row['firmware_revision'] == '':
-        #     row['firmware_revision'] = None
-        # account
-        if row['account_number'] is None or row['account_number'] == '':
-            row_errors['data_missing'] = True
-            row_errors['error_detail'].append("Account number missing")
-        else:
-            if Account.objects.filter(account_id=row['account_number']).count() == 0:
-                row_errors['account_not_exist'] = True
-                row_errors['error_detail'].append("Account with this account number does not exist")
-
-        # sub_start_date
-        if row['sub_start_date'] is None or row['sub_start_date'] == '':
-            row['sub_start_date'] = None
-        else:
-            if not type(row['sub_start_date']) == datetime.date:
-                try:
-                    row['sub_start_date'] = try_parsing_date(row['sub_start_date']).date()
-                except Exception as e:
-                    row['sub_start_date'] = None
-                    row_errors["data_missing"] = True
-                    row_errors['error_detail'].append("Unable to parse subscription start date")
-
-        # # is_active
-        # this field is no longer required
-        # if row['is_active'] is None or row['is_active'] == '':
-        #     row['is_active'] = True
-        # else:
-        #     if row['is_active'] not in ('Yes', 'No'):
-        #         row_errors['data_missing'] = True
-        # row['is_active'] = True if row['is_active'] == 'Yes' else False
-
-        row["device_upload"] = device_upload_id
-        row["errors"] = row_errors
-        return row
-
-    def parse_file(self, file, filename, device_upload_id, temp_path):
-        ext = filename.split('.')[-1]
-        imported_rows = []
-        serial_numbers = []
-        try:
-            if ext == 'csv':
-                fields = [field for field in DEVICE_IMPORT_DICTIONARY.keys()]
-                with open(temp_path, encoding='utf-8') as file_data:
-                    reader = csv.DictReader(
-                        file_data, fieldnames=fields, delimiter=',')
-                    next(reader)
-                    for row in reader:
-                        imported_rows.append(self.parse_data(
-                            row, serial_numbers, device_upload_id))
-
-            elif ext in ('xlsx',):
-                book = open_workbook(temp_path)
-                sheet = book.sheet_by_index(0)
-                keys = [sheet.cell(
-                    0, col_index).value for col_index in range(sheet.ncols)]
-                for row_index in range(1, sheet.nrows):
-                    d = {keys[col_index]: sheet.cell(row_index, col_index).value
-                         for col_index in range(sheet.ncols)}
-                    for col_index in range(sheet.ncols):
-                        cell = sheet.cell(row_index, col_index)
-                        val = cell.value
-                        if cell.ctype in (2,) and int(val) == val:
-                            val = int(val)
-                        elif cell.ctype in (3,):
-                            val = datetime.datetime(*xldate_as_tuple(val, book.datemode)).date()
-                        elif cell.ctype in (4,) and repr(val) == val:
-                            val = repr(val)
-                        d[keys[col_index]] = val
-                    d = self.parse_data(d, serial_numbers, device_upload_id)
-                    imported_rows.append(d)
-
-            device_upload_items = DeviceUploadItemSerializer(
-                data=imported_rows, many=True, context=self.get_serializer_context())
-            if device_upload_items.is_valid(raise_exception=True):
-                device_upload_items.save()
-        except Exception as e:
-            raise e
+    @action(["get"], detail=True)
+    def progress(self, request, *args, **kwargs):
+        serializer = DeviceUploadProgressSerializer(self.get_object())
+        return Response(status=status.HTTP_200_OK, data={"success": True, "data": serializer.data})
 
 
 class DeviceUploadItemsViewSet(BaseViewset):
@@ -152,16 +152,8 @@ class CanViewUserDetail(permissions.IsAuthenticated):
             if obj.account.parent_account == user.account:
                 return True
         if user_has_permission('user-view-detail-associated', user_permissions):
-            to_account_association = user.account.to_account.filter(
-                accepted=True).all()
-            from_account_association = user.account.from_account.filter(
-                accepted=True).all()
-            for acc in to_account_association:
-                if obj.account == acc.from_account:
-                    return True
-            for acc in from_account_association:
-                if obj.account == acc.to_account:
-                    return True
+            if obj.account_id in user.account.associated_ids():
+                return True
         if user_has_permission('user-view-detail-hq',
                                  user_permissions) and user.account:
             if obj.account == user.account.parent_account:
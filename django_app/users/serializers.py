@@ -149,18 +149,12 @@ class UserWritableSerializer(BaseSerializer):
 
     def validate(self, attrs):
         if attrs.get("groups", None):
-            account_users = User.objects.filter(account=self.instance.account)
-            is_account_admin = False
-            account_admin = None
-            for account_user in account_users:
-                if account_user.groups.filter(name='Account Admin').count() > 0:
-                    account_admin = account_user
-                    is_account_admin = True
-                    break
+            account_admin_id = self.instance.account.account_admin_id if self.instance.account else None
+            is_account_admin = account_admin_id is not None
 
             for group in attrs["groups"]:
                 if group.name == 'Account Admin' and is_account_admin:
-                    if account_admin != self.instance:
+                    if account_admin_id != self.instance.id:
                         raise serializers.ValidationError({"groups": "This account already has account admin"})
 
             if set(Group.objects.filter(user=self.instance)) != set(attrs["groups"]):
@@ -365,12 +359,7 @@ class SystemUserCreateSerializer(UserCreateSerializer):
         language = attrs.get("language", '')
         account_slug = attrs.get("account", '')
 
-        account_users = User.objects.filter(account=account_slug)
-        is_account_admin = False
-        for account_user in account_users:
-            if account_user.groups.filter(name='Account Admin').count() > 0:
-                is_account_admin = True
-                break
+        is_account_admin = bool(account_slug) and account_slug.account_admin_id is not None
 
         for group in attrs["groups"]:
             if group.name == 'Account Admin' and is_account_admin:
@@ -386,11 +375,10 @@ class SystemUserCreateSerializer(UserCreateSerializer):
 
             else:
 
-                user_subscriptions = account_slug.num_user_subscriptions
                 if account_slug.current_active_subscription is None:
                     raise serializers.ValidationError({"subscription": "No subscription exists"})
 
-                if account_slug.max_user_subscriptions == user_subscriptions:
+                if not account_slug.has_free_seat():
                     raise serializers.ValidationError({"subscription": "Subscription limit exceeded for this account"})
 
                 account_language = account_slug.language
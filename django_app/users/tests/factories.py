@@ -0,0 +1,23 @@
+from typing import Any, Sequence
+
+from django.contrib.auth import get_user_model
+from factory import DjangoModelFactory, Faker, Sequence as FactorySequence, post_generation
+
+
+class UserFactory(DjangoModelFactory):
+    email = FactorySequence(lambda n: 'user{0}@example.com'.format(n))
+    first_name = Faker("first_name")
+    last_name = Faker("last_name")
+    phone1 = "5555555555"
+    created_by = None
+    updated_by = None
+
+    @post_generation
+    def password(self, create: bool, extracted: Sequence[Any], **kwargs):
+        password = extracted if extracted else Faker(
+            "password", length=42, special_chars=True, digits=True, upper_case=True, lower_case=True,
+        ).generate(extra_kwargs={})
+        self.set_password(password)
+
+    class Meta:
+        model = get_user_model()
@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+from django.contrib.auth.tokens import default_token_generator
+from rest_framework.test import APIRequestFactory
+
+from django_synergy.accounts.models import Account, UserSubscription
+from django_synergy.accounts.tests.factories import AccountFactory
+from django_synergy.users.tests.factories import UserFactory
+from django_synergy.users.utils import encode_uid
+from django_synergy.users.views import UserViewSet
+
+pytestmark = pytest.mark.django_db
+
+NEW_PASSWORD = 'correct-horse-battery-staple'
+
+
+@pytest.fixture
+def account():
+    return AccountFactory()
+
+
+@pytest.fixture
+def invited(account):
+    return UserFactory(account=account, is_active=False)
+
+
+def subscribe(account, num_of_users):
+    today = datetime.date.today()
+    return UserSubscription.objects.create(account=account, num_of_users=num_of_users, is_active=True,
+                                           user_start_date=today, user_end_date=today + datetime.timedelta(days=365))
+
+
+def post(action, user, **data):
+    data.update(uid=encode_uid(user.pk), token=default_token_generator.make_token(user))
+    request = APIRequestFactory().post('/', data, format='json')
+    return UserViewSet.as_view({'post': action})(request)
+
+
+def activation(user):
+    return post('activation', user)
+
+
+def reset_password_confirm(user):
+    return post('reset_password_confirm', user, new_password=NEW_PASSWORD, re_new_password=NEW_PASSWORD)
+
+
+@pytest.mark.parametrize('confirm', [activation, reset_password_confirm])
+def test_confirm_without_subscription_activates(confirm, account, invited):
+    response = confirm(invited)
+    assert response.status_code in (200, 201)
+    invited.refresh_from_db()
+    assert invited.is_active
+    assert Account.objects.get(pk=account.pk).seats_used == 1
+
+
+@pytest.mark.parametrize('confirm', [activation, reset_password_confirm])
+def test_confirm_with_free_seat_claims_it_once(confirm, account, invited):
+    subscribe(account, num_of_users=2)
+    response = confirm(invited)
+    assert response.status_code in (200, 201)
+    invited.refresh_from_db()
+    assert invited.is_active
+    assert Account.objects.get(pk=account.pk).seats_used == 1
+
+
+@pytest.mark.parametrize('confirm', [activation, reset_password_confirm])
+def test_confirm_with_full_subscription_is_refused(confirm, account, invited):
+    subscribe(account, num_of_users=1)
+    UserFactory(account=account, is_active=True)
+    response = confirm(invited)
+    assert response.status_code == 400
+    invited.refresh_from_db()
+    assert not invited.is_active
+    assert not invited.check_password(NEW_PASSWORD)
+    assert Account.objects.get(pk=account.pk).seats_used == 1
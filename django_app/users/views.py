@@ -36,6 +36,7 @@ from django_synergy.utils.serializers import GetUserConfigSerializer
 from django_synergy.utils.views.base import BaseViewset
 from django_synergy.users import serializers
 from django_synergy.users.serializers import TimezoneLookupSerializer, SystemUserCreateSerializer, UserSerializer
+from django_synergy.accounts.exports import ExportMixin
 from django_synergy.accounts.models import Account
 from django.http import JsonResponse
 from django.contrib.auth.models import Group, Permission
@@ -48,18 +49,6 @@ User = get_user_model()
 LANGUAGES = s.LANGUAGES
 
 
-def fetchChildAccounts(account_list, current_account):
-    if current_account not in account_list:
-        account_list.append(current_account.slug)
-        # for account in current_account.subsidiaries.all():
-        #     fetchChildAccounts(account_list, account)
-    if current_account not in account_list:
-        account_list.append(current_account.slug)
-    subsidiaries = Account.objects.filter(parents__contains=current_account.account_id)
-    subsidiaries_slugs = [s.slug for s in subsidiaries]
-    account_list += subsidiaries_slugs
-
-
 def updateWidgets(user_configs, user):
     widget_configurations = WidgetConfiguration.objects.filter(user=user)
     for widget_configuration in widget_configurations:
@@ -73,12 +62,29 @@ def updateWidgets(user_configs, user):
                 widget_configuration.save()
 
 
-class UserViewSet(BaseViewset):
+class UserViewSet(ExportMixin, BaseViewset):
     # serializer_class = settings.SERIALIZERS.user
     queryset = User.objects.select_related('account').all()
     # permission_classes = settings.PERMISSIONS.user
     token_generator = default_token_generator
     lookup_field = 'slug'
+    export_filename = 'users'
+    export_related = ('account',)
+    export_columns = (
+        ('First Name', 'first_name'),
+        ('Last Name', 'last_name'),
+        ('Email', 'email'),
+        ('User Type', 'user_type'),
+        ('Account Number', 'account.account_id'),
+        ('Account Name', 'account.account_name'),
+        ('Phone', 'phone1'),
+        ('City', 'city'),
+        ('State', 'state'),
+        ('Country', 'country'),
+        ('Language', 'language'),
+        ('Active', 'is_active'),
+        ('Created On', 'created_on'),
+    )
 
     action_serializers = {
         'default': serializers.UserSerializer,
@@ -121,7 +127,8 @@ class UserViewSet(BaseViewset):
 
             subsidiary_user_list = User.objects.none()
             if user_has_permission('user-list-subsidiary', user_permissions=permission_list):
-                subsidiary_user_list = User.objects.filter(account__parents__contains=user.account.account_id)
+                subsidiary_user_list = User.objects.filter(
+                    account__in=Account.objects.descendants_of(user.account))
 
             hq_user_list = User.objects.none()
             if user_has_permission('user-list-hq', user_permissions=permission_list):
@@ -130,16 +137,7 @@ class UserViewSet(BaseViewset):
 
             associated_user_list = User.objects.none()
             if user_has_permission('user-list-associated', user_permissions=permission_list):
-                to_account_association = user.account.to_account.filter(
-                    accepted=True).all()
-                from_account_association = user.account.from_account.filter(
-                    accepted=True).all()
-
-                for account in to_account_association:
-                    associated_user_list = associated_user_list | account.from_account.users.all()
-
-                for account in from_account_association:
-                    associated_user_list = associated_user_list | account.to_account.users.all()
+                associated_user_list = User.objects.filter(account_id__in=user.account.associated_ids())
 
             contact_user_list = User.objects.none()
             if user_has_permission('user-list-contacts', user_permissions=permission_list):
@@ -295,8 +293,13 @@ class UserViewSet(BaseViewset):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.user
-        user.is_active = True
-        user.save()
+        with transaction.atomic():
+            if not Account.objects.claim_seat(user):
+                return Response(status=status.HTTP_400_BAD_REQUEST,
+                                data={"success": False,
+                                      "status_code": 400,
+                                      "message": _("User Subscriptions limit reached")})
+            user.save()
 
         signals.user_activated.send(
             sender=self.__class__, user=user, request=self.request
@@ -322,10 +325,12 @@ class UserViewSet(BaseViewset):
 
         # if user has subscriptions left
         if user.account:
-            if user.account.num_user_subscriptions < user.account.max_user_subscriptions:
-                user.is_active = True
-                user.save()
+            with transaction.atomic():
+                has_free_seat = Account.objects.claim_seat(user, require_subscription=True)
+                if has_free_seat:
+                    user.save()
 
+            if has_free_seat:
                 context = {"user": user}
                 to = [get_user_email(user)]
                 settings.EMAIL.user_activate(self.request, context).send(to)
@@ -447,11 +452,16 @@ class UserViewSet(BaseViewset):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        serializer.user.set_password(serializer.data["new_password"])
-        serializer.user.is_active = True
-        if hasattr(serializer.user, "last_login"):
-            serializer.user.last_login = now()
-        serializer.user.save()
+        with transaction.atomic():
+            if not Account.objects.claim_seat(serializer.user):
+                return Response(status=status.HTTP_400_BAD_REQUEST,
+                                data={"success": False,
+                                      "status_code": 400,
+                                      "message": _("User Subscriptions limit reached")})
+            serializer.user.set_password(serializer.data["new_password"])
+            if hasattr(serializer.user, "last_login"):
+                serializer.user.last_login = now()
+            serializer.user.save()
 
         if settings.PASSWORD_CHANGED_EMAIL_CONFIRMATION:
             context = {"user": serializer.user}